@@ -0,0 +1,93 @@
+"""
+Measure the cold start of a container: the time to `import opaca` in a fresh interpreter, and the time to create
+many agents of the same class with several decorated actions and streams. Exits with an error if one of the
+optional limits is exceeded, so it can guard against regressions, e.g. in CI.
+
+    python benchmarks/cold_start.py --agents 500 --max-import-ms 300 --max-agents-ms 200
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import Optional, List, Iterator
+
+from opaca import Container, AbstractAgent, action, stream, StreamDescription
+
+
+IMAGE = os.path.join(os.path.dirname(__file__), '..', 'resources', 'container.json')
+
+
+class BenchmarkAgent(AbstractAgent):
+    """Agent with a few typical actions and streams."""
+
+    @action
+    def add(self, x: int, y: int = 0) -> int:
+        """Add two numbers."""
+        return x + y
+
+    @action
+    async def search(self, query: str, limit: Optional[int] = None, tags: Optional[List[str]] = None) -> List[str]:
+        return [query] * (limit or 1)
+
+    @action(auth=True)
+    async def profile(self, login_token: str) -> dict:
+        return {'token': login_token}
+
+    @action(streaming=True)
+    def count(self, n: int) -> Iterator[int]:
+        yield from range(n)
+
+    @action
+    def reset(self):
+        pass
+
+    @stream(mode=StreamDescription.Mode.GET)
+    def data(self):
+        yield b'data'
+
+
+def measure_import(runs: int) -> float:
+    times = []
+    for _ in range(runs):
+        started_at = time.perf_counter()
+        subprocess.run([sys.executable, '-c', 'import opaca'], check=True)
+        times.append(time.perf_counter() - started_at)
+    # subtract the start-up time of the interpreter itself
+    baseline = []
+    for _ in range(runs):
+        started_at = time.perf_counter()
+        subprocess.run([sys.executable, '-c', 'pass'], check=True)
+        baseline.append(time.perf_counter() - started_at)
+    return (statistics.median(times) - statistics.median(baseline)) * 1000
+
+
+def measure_agents(count: int) -> float:
+    container = Container(IMAGE)
+    started_at = time.perf_counter()
+    for _ in range(count):
+        BenchmarkAgent(container=container)
+    return (time.perf_counter() - started_at) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--agents', type=int, default=500, help='number of agents to create')
+    parser.add_argument('--runs', type=int, default=5, help='number of interpreters started for measuring the import')
+    parser.add_argument('--max-import-ms', type=float, help='fail if importing opaca takes longer')
+    parser.add_argument('--max-agents-ms', type=float, help='fail if creating the agents takes longer')
+    args = parser.parse_args()
+
+    import_ms = measure_import(args.runs)
+    agents_ms = measure_agents(args.agents)
+    print(f'import opaca:          {import_ms:8.1f} ms')
+    print(f'create {args.agents:>5} agents:    {agents_ms:8.1f} ms ({agents_ms / args.agents * 1000:.0f} us per agent)')
+
+    failed = (args.max_import_ms is not None and import_ms > args.max_import_ms) or \
+             (args.max_agents_ms is not None and agents_ms > args.max_agents_ms)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""
+Compare the throughput and latency of a container run with the default (development) and the production profile.
+
+Each profile is served by its own uvicorn process, which is then loaded with concurrent requests to a small
+action and to the agent descriptions. Requires `httpx`.
+
+    python benchmarks/profiles.py --duration 10 --concurrency 64
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import statistics
+import time
+
+import httpx
+
+from opaca import Container, AbstractAgent, action, run
+
+
+IMAGE = os.path.join(os.path.dirname(__file__), '..', 'resources', 'container.json')
+
+
+class BenchmarkAgent(AbstractAgent):
+
+    @action
+    async def echo(self, text: str, count: int = 1) -> dict:
+        return {'text': text, 'items': [{'index': i, 'value': text} for i in range(count)]}
+
+
+def serve(profile: str, port: int):
+    container = Container(IMAGE)
+    BenchmarkAgent(container=container, agent_id='benchmark')
+    run(container, host='127.0.0.1', port=port, profile=profile)
+
+
+async def wait_until_ready(client: httpx.AsyncClient):
+    for _ in range(100):
+        try:
+            await client.get('/info')
+            return
+        except httpx.TransportError:
+            await asyncio.sleep(0.1)
+    raise RuntimeError('Server did not start.')
+
+
+async def load(base_url: str, method: str, path: str, body, duration: float, concurrency: int):
+    latencies = []
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits) as client:
+        await wait_until_ready(client)
+        deadline = time.perf_counter() + duration
+
+        async def worker():
+            while (started_at := time.perf_counter()) < deadline:
+                response = await client.request(method, path, json=body)
+                response.raise_for_status()
+                latencies.append(time.perf_counter() - started_at)
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    latencies.sort()
+    return len(latencies) / duration, statistics.median(latencies), latencies[int(len(latencies) * 0.99)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--duration', type=float, default=5.0, help='seconds of load per scenario')
+    parser.add_argument('--concurrency', type=int, default=32, help='number of concurrent requests')
+    parser.add_argument('--port', type=int, default=8899)
+    args = parser.parse_args()
+
+    scenarios = [
+        ('invoke small', 'POST', '/invoke/Echo', {'text': 'hello'}),
+        ('invoke 100 items', 'POST', '/invoke/Echo', {'text': 'hello', 'count': 100}),
+        ('agent descriptions', 'GET', '/agents', None),
+    ]
+    print(f'{"profile":<12} {"scenario":<20} {"req/s":>10} {"p50 ms":>8} {"p99 ms":>8}')
+    for index, profile in enumerate(('development', 'production')):
+        port = args.port + index
+        server = multiprocessing.Process(target=serve, args=(profile, port), daemon=True)
+        server.start()
+        try:
+            for name, method, path, body in scenarios:
+                rate, p50, p99 = asyncio.run(load(f'http://127.0.0.1:{port}', method, path, body, args.duration, args.concurrency))
+                print(f'{profile:<12} {name:<20} {rate:>10.0f} {p50 * 1000:>8.2f} {p99 * 1000:>8.2f}')
+        finally:
+            server.terminate()
+            server.join()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,32 +1,90 @@
-from fastapi import FastAPI as _FastAPI
+from concurrent.futures import Executor as _Executor
+from typing import Callable as _Callable, TYPE_CHECKING as _TYPE_CHECKING
 
 from .decorators import action, stream
-from .routes import create_routes
+from .caching import CachePolicy
+from .executors import is_cancelled
+from .tasks import TaskManager, report_progress
+from .platform_client import PlatformClient
+from .sessions import SessionManager, MemorySessionStore, SqliteSessionStore, RedisSessionStore
 from .container import Container
 from .abstract_agent import AbstractAgent
+from .pools import AgentPool
+from .profiles import get_server_options as _get_server_options
+from .workers import run_workers as _run_workers, create_container as _create_container
 from .models import (Parameter,
                      ActionDescription,
                      AgentDescription,
                      StreamDescription,
                      Message)
 
+if _TYPE_CHECKING:
+    from fastapi import FastAPI as _FastAPI
+    from .routes import create_routes
 
-def run(container: Container,
+
+def __getattr__(name: str):
+    # FastAPI is only imported once the routes are actually created
+    if name == 'create_routes':
+        from .routes import create_routes
+        return create_routes
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def run(container: Container | _Callable[[], Container] | str,
         title: str | None = None,
         host: str | None = None,
         port: int | None = None,
-        app: _FastAPI | None = None,
+        app: '_FastAPI | None' = None,
+        executor: str | _Executor | None = None,
+        max_workers: int | None = None,
+        metrics: bool = False,
+        manage_agents: bool = False,
+        workers: int = 1,
+        profile: str = 'development',
+        keep_alive: int | None = None,
+        backlog: int | None = None,
+        limit_concurrency: int | None = None,
     ) -> None:
     """
     Run the container with uvicorn.
 
-    :param container: The agent container to run the application with.
+    :param container: The agent container to run the application with. With more than one worker, a function
+    creating the container and its agents, defined at the top level of a module, or its "module:function" import string.
     :param title: The title of the application. Defaults to the image name specified in the container image.
     :param host: The hostname to run the application on. Defaults to '0.0.0.0'.
     :param port: The port to run the application on. Defaults to the apiPort specified in the container image.
     :param app: The FastAPI object with the routes. If this is provided,
-    the title argument becomes irrelevant. Defaults to the standard OPACA routes.
+    the title argument becomes irrelevant. Defaults to the standard OPACA routes. Not supported with several workers.
+    :param executor: The default executor for synchronous actions, either 'thread', 'process', 'inline'
+    or an Executor instance. Defaults to the executor the container was created with.
+    :param max_workers: The maximum number of workers in the executor pool.
+    :param metrics: Whether to provide a `/metrics` route in the Prometheus text format. Ignored if app is provided.
+    :param manage_agents: Whether to provide the unprotected routes for spawning and retiring agents at runtime.
+    Ignored if app is provided. Not supported with several workers.
+    :param workers: The number of worker processes, each creating its own container with the container function.
+    :param profile: Either 'development' or 'production'. The production profile turns off debug mode and the access
+    log, serializes action results directly and uses uvloop and httptools if installed. Ignored for the routes if app is provided.
+    :param keep_alive: Seconds to keep idle connections open. Defaults to 5, or 30 in the production profile.
+    :param backlog: Maximum number of connections waiting to be accepted. Defaults to 2048.
+    :param limit_concurrency: Maximum number of concurrent connections and tasks, before responding with 503.
     """
+    server_options = _get_server_options(profile, keep_alive, backlog, limit_concurrency)
+
+    if workers > 1:
+        if isinstance(container, Container) or app is not None:
+            raise ValueError('Running several workers requires a function creating the container instead of a '
+                             'container or app, so that each worker can create its own container and agents.')
+        if manage_agents:
+            raise ValueError('Spawning and retiring agents via routes is not supported with several workers, '
+                             'since each worker has its own agents.')
+        _run_workers(container, workers, host or '0.0.0.0', port, server_options,
+                     {'title': title, 'executor': executor, 'max_workers': max_workers, 'metrics': metrics, 'profile': profile})
+        return
+
+    if not isinstance(container, Container):
+        container = _create_container(container)
+
     if title is None:
         title = container.image.imageName
 
@@ -36,8 +94,15 @@ def run(container: Container,
     if port is None:
         port = container.image.apiPort
 
+    if executor is not None or max_workers is not None:
+        container.set_executor(executor or container.executors.default, max_workers)
+
     if app is None:
-        app = create_routes(title, container)
+        from .routes import create_routes
+        app = create_routes(title, container, metrics=metrics, profile=profile, manage_agents=manage_agents)
 
     import uvicorn
-    uvicorn.run(app, host=host, port=port)
+    try:
+        uvicorn.run(app, host=host, port=port, **server_options)
+    finally:
+        container.executors.shutdown()
@@ -1,29 +1,57 @@
-from typing import Dict, List, Any, Optional, Callable, TYPE_CHECKING
-from inspect import getdoc, iscoroutinefunction
-import uuid
+from typing import Dict, List, Any, Optional, Callable, AsyncIterator, Tuple, Deque, TYPE_CHECKING
+from collections import deque
+import asyncio
+import functools
+import time
+from inspect import getdoc, iscoroutinefunction, isasyncgenfunction
 
 from .models import AgentDescription, ActionDescription, Message, StreamDescription, Parameter, LoginMsg
 from .utils import http_error
-from .decorators import register_actions, register_streams
+from .decorators import register_members
+from .validation import make_validator
+from .caching import ResultCache, SingleFlight, make_key
+from .limits import ConcurrencyLimiter, LimitedIterator, remaining_time, run_with_timeout
+from .executors import WorkTracker
+from .streams import iterate_in_thread
+from .inbox import Inbox
 
 if TYPE_CHECKING:
     from .container import Container
 
 
+def collect(callback: Callable, **parameters) -> List[Any]:
+    return list(callback(**parameters))
+
+
 class AbstractAgent:
 
-    def __init__(self, container: 'Container', agent_id: str = '', agent_type: str = '', description: Optional[str] = None):
+    def __init__(self, container: 'Container', agent_id: str = '', agent_type: str = '', description: Optional[str] = None,
+                 inbox_size: int = 1000, inbox_overflow: str = 'drop-oldest'):
         self.container: 'Container' = container
-        self.agent_id: str = agent_id if agent_id else str(uuid.uuid4())
         self.agent_type: str = agent_type or self.__class__.__name__
+        self.agent_id: str = agent_id if agent_id else container.make_agent_id(self.agent_type)
         self.description: str = description or getdoc(self.__class__)
         self.actions: Dict[str, ActionDescription] = {}
         self.streams: Dict[str, StreamDescription] = {}
-        self.messages: List[Message] = []
+        self.messages: Deque[Message] = deque(maxlen=inbox_size)
+        self.inbox: Inbox = Inbox(self.receive_message, inbox_size, inbox_overflow)
+        self.in_flight: int = 0
 
         self.container.add_agent(self)
-        register_actions(self)
-        register_streams(self)
+        register_members(self)
+
+    def __getstate__(self):
+        """
+        Drop the reference to the container, the inbox and the registered actions and streams when pickling,
+        e.g. for running actions in a process pool. Their validators, caches and limiters can not be pickled,
+        and the copy of the agent only needs the callback it is running.
+        """
+        state = self.__dict__.copy()
+        state['container'] = None
+        state['inbox'] = None
+        state['actions'] = {}
+        state['streams'] = {}
+        return state
 
     def get_action(self, name: str):
         """
@@ -39,18 +67,31 @@ class AbstractAgent:
         """
         return name in self.actions
 
-    def add_action(self, name: str, description: Optional[str], parameters: Dict[str, Parameter], result: Parameter, callback: Callable):
+    def add_action(self, name: str, description: Optional[str], parameters: Dict[str, Parameter], result: Parameter, callback: Callable,
+                   validator: Optional[Callable[[Dict[str, Any]], Dict[str, Any]]] = None):
         """
         Add an action to the publicly visible list of actions this agent can perform.
+        The validator for the parameters is compiled from the parameters and callback if not given.
         """
         if not self.knows_action(name):
+            cache_policy = getattr(callback, '_cache', None)
+            max_concurrency = getattr(callback, '_max_concurrency', None)
+            if max_concurrency is None and getattr(callback, '_queue_size', None) is not None:
+                raise ValueError(f'The queue_size of action {name} can only be used together with max_concurrency.')
             self.actions[name] = ActionDescription(
                 name=name,
                 description=description,
                 parameters=parameters,
                 result=result,
                 callback=callback,
+                validator=validator or make_validator(name, parameters, callback),
+                cache=ResultCache(cache_policy) if cache_policy is not None else None,
+                single_flight=SingleFlight() if getattr(callback, '_coalesce', False) else None,
+                limiter=ConcurrencyLimiter(max_concurrency, getattr(callback, '_queue_size', None))
+                    if max_concurrency is not None else None,
             )
+            if self.container is not None:
+                self.container.index_action(name, self)
 
     def remove_action(self, name: str):
         """
@@ -58,33 +99,137 @@ class AbstractAgent:
         """
         if self.knows_action(name):
             del self.actions[name]
+            if self.container is not None:
+                self.container.unindex_action(name, self)
 
     async def invoke_action(self, name: str, parameters: Dict[str, Any], login_token: str) -> Optional[Any]:
         """
-        Invoke action on this agent.
+        Invoke action on this agent. The partial results of streaming actions are returned as a list.
+        """
+        action, parameters = self.prepare_invocation(name, parameters, login_token)
+        # counted right away, also while waiting for a cached result, a coalesced call or a free slot,
+        # and until callbacks still running in a thread after a timeout have finished, so that drain waits for them
+        self.in_flight += 1
+        tracker = WorkTracker()
+        try:
+            with tracker:
+                if action.cache is not None:
+                    return await action.cache.get_or_call(parameters, lambda: self.run_limited(action, parameters))
+                key = make_key(parameters) if action.single_flight is not None else None
+                if key is not None:
+                    return await action.single_flight.call(key, lambda: self.run_limited(action, parameters))
+                return await self.run_limited(action, parameters)
+        finally:
+            tracker.when_done(self.finish_invocation)
+
+    async def invoke_action_stream(self, name: str, parameters: Dict[str, Any], login_token: str) -> AsyncIterator[Any]:
+        """
+        Invoke a streaming action on this agent, returning an async iterator over its partial results.
+        The invocation waits for a free slot if the action's concurrency is limited, and the whole stream
+        has to finish within the same timeout as other invocations. Close the iterator if it is not exhausted.
+        """
+        action, parameters = self.prepare_invocation(name, parameters, login_token)
+        if not getattr(action.callback, '_streaming', False):
+            raise http_error(400, f'Action {name} does not stream its results.')
+        timeout = self.get_timeout(action)
+        started_at = time.monotonic()
+        self.in_flight += 1
+        try:
+            running_since = await action.limiter.acquire(timeout) if action.limiter is not None else None
+        except BaseException:
+            self.finish_invocation()
+            raise
+        return LimitedIterator(self.iterate_action(action.callback, parameters), timeout, started_at, action.limiter,
+                               running_since, self.finish_invocation)
+
+    def finish_invocation(self):
+        self.in_flight -= 1
+
+    def prepare_invocation(self, name: str, parameters: Dict[str, Any], login_token: str) -> Tuple[ActionDescription, Dict[str, Any]]:
+        """
+        Look up the action and validate the parameters, adding the login token for actions requiring authentication.
         """
         if not self.knows_action(name):
             raise http_error(400, f'Unknown action: {name}.')
 
-        try:
-            action = self.get_action(name)
-            callback = action.callback
+        action = self.get_action(name)
+        parameters = action.validator(parameters)
+
+        if getattr(action.callback, '_auth', False):
+            if not login_token:
+                raise http_error(401, 'Missing or expired credentials')
+            parameters['login_token'] = login_token
+        return action, parameters
+
+    async def iterate_action(self, callback: Callable, parameters: Dict[str, Any]) -> AsyncIterator[Any]:
+        """
+        Iterate the partial results of a streaming action, running synchronous generators in a thread
+        of the action's executor or the container's.
+        """
+        if isasyncgenfunction(callback):
+            async for result in callback(**parameters):
+                yield result
+        else:
+            executor = self.container.executors.get_thread_executor(getattr(callback, '_executor', None)) \
+                if self.container is not None else None
+            async for batch in iterate_in_thread(callback(**parameters), executor):
+                for result in batch:
+                    yield result
 
-            if getattr(callback, '_auth', False):
-                if not login_token:
-                    raise http_error(401, 'Missing credentials')
-                parameters['login_token'] = login_token
+    async def run_limited(self, action: ActionDescription, parameters: Dict[str, Any]) -> Optional[Any]:
+        """
+        Run the action callback, respecting the action's concurrency limits, if any, and the action's timeout,
+        the container's default timeout or the deadline of the current request, whichever is shortest.
+        """
+        timeout = self.get_timeout(action)
+        if action.limiter is not None:
+            return await action.limiter.run(lambda: self.run_callback(action.callback, parameters), timeout)
+        return await run_with_timeout(lambda: self.run_callback(action.callback, parameters), timeout)
+
+    def get_timeout(self, action: ActionDescription) -> Optional[float]:
+        """
+        Get the timeout of an invocation of the action, the action's timeout, the container's default timeout
+        or the time left until the deadline of the current request, whichever is shortest.
+        """
+        timeout = getattr(action.callback, '_timeout', None)
+        if timeout is None and self.container is not None:
+            timeout = self.container.action_timeout
+        return remaining_time(timeout)
 
-            if iscoroutinefunction(callback):
-                return await callback(**parameters)
-            else:
-                return callback(**parameters)
+    async def run_callback(self, callback: Callable, parameters: Dict[str, Any]) -> Optional[Any]:
+        """
+        Run the action callback, either directly if it is a coroutine or in the container's executor.
+        """
+        executor = getattr(callback, '_executor', None)
+        if getattr(callback, '_streaming', False):
+            if isasyncgenfunction(callback):
+                return [result async for result in self.iterate_action(callback, parameters)]
+            callback = functools.partial(collect, callback)
 
-        except TypeError:
-            if "login_token" in parameters.keys():
-                parameters.pop("login_token")
-            msg = f'Invalid action parameters. Provided: {parameters}, Required: {self.get_action(name)["parameters"]}'
-            raise http_error(400, msg)
+        if iscoroutinefunction(callback):
+            return await callback(**parameters)
+        elif self.container is not None:
+            return await self.container.executors.run(callback, parameters, executor)
+        else:
+            return callback(**parameters)
+
+    def get_action_stats(self) -> Dict[str, Dict[str, int]]:
+        """
+        Get runtime statistics for all actions of this agent that are cached, coalesced or limited.
+        """
+        stats = {}
+        for name, action in self.actions.items():
+            if action.cache is not None:
+                stats.setdefault(name, {}).update(cacheHits=action.cache.hits, cacheMisses=action.cache.misses,
+                                                  cacheEntries=len(action.cache.entries),
+                                                  coalesced=action.cache.single_flight.coalesced)
+            if action.single_flight is not None:
+                stats.setdefault(name, {}).update(coalesced=action.single_flight.coalesced,
+                                                  inFlight=len(action.single_flight.in_flight))
+            if action.limiter is not None:
+                stats.setdefault(name, {}).update(running=action.limiter.running, queued=action.limiter.waiting,
+                                                  rejected=action.limiter.rejected)
+        return stats
 
     def get_stream(self, name: str) -> Optional[Any]:
         """
@@ -100,31 +245,44 @@ class AbstractAgent:
         """
         return name in self.streams
 
-    def add_stream(self, name: str, description: Optional[str], mode: StreamDescription.Mode, callback: Callable):
+    def add_stream(self, name: str, description: Optional[str], mode: StreamDescription.Mode, callback: Callable,
+                   media_type: Optional[str] = None, chunk_size: Optional[int] = None, flush_interval: Optional[float] = None):
         """
         Add a stream to this agent's action publicly visible list of streams.
+        For GET streams, the media type of the response can be set, as well as the chunk size up to which
+        small items yielded by the stream are joined and the interval after which they are sent anyway.
         """
         if not self.knows_stream(name):
+            options = {'media_type': media_type, 'chunk_size': chunk_size, 'flush_interval': flush_interval}
             self.streams[name] = StreamDescription(
                 name=name,
                 description=description,
                 mode=mode,
                 callback=callback,
+                **{key: value for key, value in options.items() if value is not None},
             )
+            if self.container is not None:
+                self.container.index_stream(name, self)
 
-    def invoke_stream(self, name: str, mode: StreamDescription.Mode, login_token: str = None):
+    def invoke_stream(self, name: str, mode: StreamDescription.Mode, login_token: str = None, body: Optional[AsyncIterator[bytes]] = None):
         """
-        GET a stream response from this agent or POST a stream to it.
+        GET a stream response from this agent or POST a stream to it. For POST streams, the callback is
+        given an async iterator over the chunks of the request body and its (awaitable) result is returned.
         """
         if not self.knows_stream(name):
             raise http_error(400, f'Unknown stream: {name}.')
 
+        stream = self.get_stream(name)
+        if stream.mode != mode:
+            raise http_error(400, f'Stream {name} does not support mode {mode.value}.')
+
+        auth = getattr(stream.callback, '_auth', False)
+        if auth and not login_token:
+            raise http_error(401, 'Missing or expired credentials')
         if mode == StreamDescription.Mode.GET:
-            if getattr(self.get_stream(name).callback, '_auth', False):
-                return self.get_stream(name).callback(login_token)
-            return self.get_stream(name).callback()
+            return stream.callback(login_token) if auth else stream.callback()
         elif mode == StreamDescription.Mode.POST:
-            raise http_error(500, f'Functionality for POSTing streams not yet implemented.')
+            return stream.callback(body, login_token) if auth else stream.callback(body)
         else:
             raise http_error(400, f'Unknown mode: {mode}')
 
@@ -134,16 +292,34 @@ class AbstractAgent:
         """
         if self.knows_stream(name):
             del self.streams[name]
+            if self.container is not None:
+                self.container.unindex_stream(name, self)
+
+    def get_load(self) -> int:
+        """
+        Get the number of invocations this agent is currently running or that are waiting for a free slot.
+        """
+        return self.in_flight
+
+    async def drain(self):
+        """
+        Wait until the agent has handled all messages in its inbox and finished all running invocations.
+        """
+        await self.inbox.join()
+        while self.get_load() > 0:
+            await asyncio.sleep(0.05)
 
     def receive_message(self, message: Message):
         """
-        Override in subclasses to do something with the message.
+        Override in subclasses to do something with the message. Messages are delivered one after another
+        by the agent's inbox; override this with an `async` method for handling messages that takes longer.
+        By default, the last messages are kept in `self.messages`.
         """
         self.messages.append(message)
 
     def subscribe_channel(self, channel: str):
         """
-        Subscribe to a broadcasting channel.
+        Subscribe to a broadcasting channel, or to all channels matching a pattern like "sensors/*/temperature" or "sensors/#".
         """
         if self.container is not None:
             self.container.subscribe_channel(channel, self)
@@ -0,0 +1,217 @@
+import dataclasses
+import io
+import math
+import sys
+from typing import Any, Callable, List, Optional, Union, Literal, get_args, get_origin
+
+from typing_extensions import Annotated
+from pydantic import BaseModel, BeforeValidator
+
+
+# MessagePack extension type of arrays, whose data is the array in the .npy format
+NPY_EXT_TYPE = 78
+
+# CBOR tag of multi-dimensional arrays in row-major order, see RFC 8746
+CBOR_MULTI_DIM_TAG = 40
+CBOR_TYPED_ARRAY_TAGS = range(64, 88)
+
+
+def is_array_hint(hint: Any) -> bool:
+    """
+    Whether the type hint is a NumPy array, e.g. `np.ndarray` or `npt.NDArray[np.float64]`.
+    Checked by name, so that NumPy does not have to be imported for actions that do not use it.
+    """
+    origin = get_origin(hint) or hint
+    return getattr(origin, '__module__', None) == 'numpy' and getattr(origin, '__name__', None) == 'ndarray'
+
+
+def is_array(value: Any) -> bool:
+    np = sys.modules.get('numpy')
+    return np is not None and isinstance(value, np.ndarray)
+
+
+def get_dtype(hint: Any) -> Optional[str]:
+    """
+    Get the name of the dtype of an array type hint, e.g. "float64", or None if it is not specific.
+    """
+    args = get_args(hint)
+    scalar_type = get_args(args[1])[0] if len(args) == 2 and get_args(args[1]) else None
+    if not isinstance(scalar_type, type):
+        return None
+    import numpy as np
+    if scalar_type in (np.generic, np.number, np.integer, np.floating, np.inexact, np.signedinteger, np.unsignedinteger):
+        return None
+    return np.dtype(scalar_type).name
+
+
+def get_shape(hint: Any) -> Optional[List[Optional[int]]]:
+    """
+    Get the shape of an array type hint, with None for dimensions of any size, e.g. [3, None] for
+    `np.ndarray[tuple[Literal[3], int], np.dtype[np.float64]]`, or None if the number of dimensions is unknown.
+    """
+    args = get_args(hint)
+    shape_args = get_args(args[0]) if args and get_origin(args[0]) is tuple else None
+    if shape_args is None or Ellipsis in shape_args:
+        return None
+    return [get_args(arg)[0] if get_origin(arg) is Literal else None for arg in shape_args]
+
+
+def get_items_type(dtype: Optional[str]) -> str:
+    """
+    Get the JSON type of the elements of an array with the dtype.
+    """
+    if dtype is None:
+        return "number"
+    if dtype == "bool":
+        return "boolean"
+    if dtype.startswith(("int", "uint")):
+        return "integer"
+    if dtype.startswith("float"):
+        return "number"
+    return "string" if dtype.startswith(("str", "bytes")) else "object"
+
+
+def make_array_hint(dtype: Optional[str], shape: Optional[List[Optional[int]]]) -> Any:
+    """
+    Get a type hint validating arrays with the dtype and shape, also accepting (nested) lists, e.g. from JSON.
+    Arrays that already have the dtype are passed on without copying them.
+    """
+    import numpy as np
+    target = np.dtype(dtype) if dtype is not None else None
+
+    def convert(value: Any) -> Any:
+        try:
+            if isinstance(value, np.ndarray):
+                array = value if target is None else value.astype(target, casting='same_kind', copy=False)
+            else:
+                array = np.asarray(value, dtype=target)
+        except (TypeError, ValueError) as e:
+            raise ValueError(f'Invalid array: {e}')
+        if shape is not None and (array.ndim != len(shape) or any(n is not None and n != m for n, m in zip(shape, array.shape))):
+            expected = ', '.join('*' if n is None else str(n) for n in shape)
+            raise ValueError(f'Expected array of shape ({expected}), got {array.shape}')
+        return array
+
+    return Annotated[np.ndarray, BeforeValidator(convert)]
+
+
+def resolve_hint(hint: Any) -> Any:
+    """
+    Replace array type hints, also within Optional or Union, by hints validating their dtype and shape.
+    """
+    if is_array_hint(hint):
+        return make_array_hint(get_dtype(hint), get_shape(hint))
+    if get_origin(hint) is Union and any(is_array_hint(arg) for arg in get_args(hint)):
+        return Union[tuple(resolve_hint(arg) for arg in get_args(hint))]
+    return hint
+
+
+def to_builtin(value: Any) -> Any:
+    """
+    Fallback for serializing arrays and NumPy scalars as JSON, converting them to (nested) lists and numbers.
+    """
+    np = sys.modules.get('numpy')
+    if np is not None and isinstance(value, (np.ndarray, np.generic)):
+        return value.tolist()
+    raise TypeError(f'Object of type {type(value).__name__} is not serializable')
+
+
+def contains_array(value: Any) -> bool:
+    """
+    Whether the value is an array or NumPy scalar, or contains one at any depth of its dicts, lists,
+    pydantic models or dataclasses.
+    """
+    np = sys.modules.get('numpy')
+    if np is None:
+        return False
+    pending = [value]
+    while pending:
+        value = pending.pop()
+        if isinstance(value, (np.ndarray, np.generic)):
+            return True
+        if isinstance(value, dict):
+            pending.extend(value.values())
+        elif isinstance(value, (list, tuple, set, frozenset)):
+            pending.extend(value)
+        elif isinstance(value, BaseModel) or (dataclasses.is_dataclass(value) and not isinstance(value, type)):
+            pending.extend(vars(value).values())
+    return False
+
+
+def to_npy(array: Any) -> Optional[bytes]:
+    """
+    Write the array in the .npy format, or return None if it contains Python objects.
+    """
+    if array.dtype.hasobject:
+        return None
+    import numpy as np
+    buffer = io.BytesIO()
+    np.lib.format.write_array(buffer, array, allow_pickle=False)
+    return buffer.getvalue()
+
+
+def from_npy(data: bytes) -> Any:
+    """
+    Read an array in the .npy format. The array is a read-only view of the data, without copying it.
+    """
+    import numpy as np
+    stream = io.BytesIO(data)
+    version = np.lib.format.read_magic(stream)
+    if version == (1, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(stream)
+    else:
+        shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(stream)
+    if dtype.hasobject:
+        raise ValueError('Arrays of Python objects are not supported.')
+    array = np.frombuffer(data, dtype=dtype, count=math.prod(shape), offset=stream.tell())
+    return array.reshape(shape, order='F' if fortran_order else 'C')
+
+
+def get_typed_array_tag(dtype: Any) -> Optional[int]:
+    """
+    Get the CBOR tag of little-endian typed arrays of the dtype, see RFC 8746, or None if there is none.
+    """
+    if dtype.kind in 'ui' and dtype.itemsize in (1, 2, 4, 8):
+        size = int(math.log2(dtype.itemsize))
+        return (72 if dtype.kind == 'i' else 64) + (4 if size else 0) + size
+    if dtype.kind == 'f' and dtype.itemsize in (2, 4, 8):
+        return 84 + int(math.log2(dtype.itemsize)) - 1
+    return None
+
+
+def get_typed_array_dtype(tag: int) -> Any:
+    """
+    Get the dtype of typed arrays with the CBOR tag.
+    """
+    import numpy as np
+    is_float, is_signed, little_endian, size = tag >> 4 & 1, tag >> 3 & 1, tag >> 2 & 1, tag & 3
+    order = '<' if little_endian else '>'
+    if is_float:
+        return np.dtype(f'{order}f{2 ** (size + 1)}')
+    return np.dtype(f'{order}{"i" if is_signed else "u"}{2 ** size}')
+
+
+def to_cbor(array: Any, make_tag: Callable[[int, Any], Any]) -> Any:
+    """
+    Get the CBOR representation of the array, a typed array if it is one-dimensional and a multi-dimensional
+    array of its shape and a typed array otherwise, tagged with make_tag. Arrays of other types are sent as lists.
+    """
+    tag = get_typed_array_tag(array.dtype)
+    if tag is None or array.ndim == 0:
+        return array.tolist()
+    import numpy as np
+    data = make_tag(tag, np.ascontiguousarray(array, dtype=array.dtype.newbyteorder('<')).tobytes())
+    if array.ndim == 1:
+        return data
+    return make_tag(CBOR_MULTI_DIM_TAG, [list(array.shape), data])
+
+
+def from_cbor(tag: int, value: Any) -> Any:
+    """
+    Read a typed array or multi-dimensional array with the CBOR tag, without copying its data.
+    """
+    import numpy as np
+    if tag == CBOR_MULTI_DIM_TAG:
+        shape, array = value
+        return np.asarray(array).reshape(shape)
+    return np.frombuffer(value, dtype=get_typed_array_dtype(tag))
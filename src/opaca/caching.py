@@ -0,0 +1,162 @@
+import asyncio
+import copy
+import hashlib
+import json
+import sys
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Callable, Awaitable, Optional, Tuple
+
+from pydantic_core import to_json, to_jsonable_python
+
+
+def get_key_value(value: Any) -> Any:
+    """
+    Fallback for parameters without a JSON representation. Arrays are keyed by their dtype, shape and
+    a hash of their data, other objects cannot be keyed exactly and raise a TypeError.
+    """
+    np = sys.modules.get('numpy')
+    if np is not None and isinstance(value, np.ndarray):
+        data = np.ascontiguousarray(value).tobytes()
+        return {'dtype': value.dtype.str, 'shape': list(value.shape), 'sha256': hashlib.sha256(data).hexdigest()}
+    if np is not None and isinstance(value, np.generic):
+        return {'dtype': value.dtype.str, 'value': value.item()}
+    raise TypeError(f'Object of type {type(value).__name__} cannot be used as a key')
+
+
+def make_key(parameters: Dict[str, Any]) -> Optional[str]:
+    """
+    Canonicalize the (validated) action parameters into a key, independent of the order of the parameters.
+    If the action requires authentication, the login token is part of the parameters and thus of the key.
+    Returns None if a parameter cannot be keyed exactly, e.g. an instance of a plain class, so that
+    the invocation is neither cached nor coalesced with others.
+    """
+    try:
+        return json.dumps(to_jsonable_python(parameters, fallback=get_key_value), sort_keys=True, separators=(',', ':'))
+    except (TypeError, ValueError):
+        return None
+
+
+def get_size(result: Any) -> int:
+    """
+    Estimate the size of a result by its JSON size, counting arrays by the size of their data.
+    """
+    array_size = 0
+
+    def fallback(value: Any) -> Any:
+        nonlocal array_size
+        np = sys.modules.get('numpy')
+        if np is not None and isinstance(value, np.ndarray):
+            array_size += value.nbytes
+            return None
+        if np is not None and isinstance(value, np.generic):
+            return value.item()
+        return repr(value)
+
+    return len(to_json(result, fallback=fallback)) + array_size
+
+
+class SingleFlight:
+    """
+    Shares one execution between all concurrent calls with the same key.
+    """
+
+    def __init__(self):
+        self.in_flight: Dict[str, asyncio.Future] = {}
+        self.coalesced: int = 0
+
+    async def call(self, key: str, func: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Await the call already in flight for the key, or start a new one. The call runs in its own task,
+        so that it is not cancelled if only one of the callers waiting for it is cancelled.
+        """
+        if key in self.in_flight:
+            self.coalesced += 1
+        else:
+            task = asyncio.ensure_future(func())
+            self.in_flight[key] = task
+            task.add_done_callback(lambda _: self.done(key, task))
+        return await asyncio.shield(self.in_flight[key])
+
+    def done(self, key: str, task: asyncio.Future):
+        if self.in_flight.get(key) is task:
+            del self.in_flight[key]
+        if not task.cancelled():
+            # mark the exception as retrieved in case all callers have been cancelled in the meantime
+            task.exception()
+
+
+class CachePolicy:
+    """
+    Configuration for caching the results of an idempotent action.
+
+    :param ttl: Seconds after which a cached result expires. Never expires if None.
+    :param max_entries: Maximum number of cached results, least recently used results are evicted first.
+    :param max_bytes: Optional bound for the total size of all cached results, estimated by their JSON size
+    and arrays by the size of their data.
+    """
+
+    def __init__(self, ttl: Optional[float] = None, max_entries: int = 1024, max_bytes: Optional[int] = None):
+        self.ttl: Optional[float] = ttl
+        self.max_entries: int = max_entries
+        self.max_bytes: Optional[int] = max_bytes
+
+
+class ResultCache:
+    """
+    LRU cache for the results of an action with the given policy. Concurrent misses for the same
+    parameters are coalesced into a single invocation of the action. The cache keeps its own copy of
+    each result and hands out copies of it, so that callers modifying a result do not affect other callers.
+    """
+
+    def __init__(self, policy: CachePolicy):
+        self.policy: CachePolicy = policy
+        self.entries: OrderedDict[str, Tuple[float, int, Any]] = OrderedDict()
+        self.size: int = 0
+        self.hits: int = 0
+        self.misses: int = 0
+        self.single_flight: SingleFlight = SingleFlight()
+
+    async def get_or_call(self, parameters: Dict[str, Any], func: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Get the cached result for the parameters, or call the function and cache its result.
+        """
+        key = make_key(parameters)
+        if key is None:
+            self.misses += 1
+            return await func()
+        if key in self.entries:
+            expires_at, _, result = self.entries[key]
+            if expires_at > time.monotonic():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return copy.deepcopy(result)
+            self.remove(key)
+
+        self.misses += 1
+        return await self.single_flight.call(key, lambda: self.call_and_store(key, func))
+
+    async def call_and_store(self, key: str, func: Callable[[], Awaitable[Any]]) -> Any:
+        result = await func()
+        size = get_size(result) if self.policy.max_bytes is not None else 0
+        expires_at = time.monotonic() + self.policy.ttl if self.policy.ttl is not None else float('inf')
+        self.remove(key)
+        self.entries[key] = (expires_at, size, copy.deepcopy(result))
+        self.size += size
+        while self.entries and (len(self.entries) > self.policy.max_entries
+                                or (self.policy.max_bytes is not None and self.size > self.policy.max_bytes)):
+            self.remove(next(iter(self.entries)))
+        return result
+
+    def remove(self, key: str):
+        if key in self.entries:
+            self.size -= self.entries.pop(key)[1]
+
+    def purge(self) -> int:
+        """
+        Remove all cached results, returning the number of removed results.
+        """
+        count = len(self.entries)
+        self.entries.clear()
+        self.size = 0
+        return count
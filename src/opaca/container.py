@@ -1,18 +1,45 @@
 import os
 import uuid
+import asyncio
+import hashlib
 from datetime import datetime
-from typing import Dict, List, Any
+from concurrent.futures import Executor
+from typing import Dict, List, Set, Any, Optional, Union, Tuple, Callable, AsyncIterator, TYPE_CHECKING
 import json
 
+from pydantic import TypeAdapter
+
 from .abstract_agent import AbstractAgent
-from .models import ContainerDescription, AgentDescription, Message, ImageDescription, StreamDescription, LoginMsg, \
-    Login
+from .models import ContainerDescription, AgentDescription, ActionDescription, Message, ImageDescription, StreamDescription, LoginMsg, \
+    Login, BatchInvocation, BatchResult
+from .executors import ExecutorPool
+from .platform_client import PlatformClient
+from .topics import TopicTree
+from .sessions import SessionManager
+from .tasks import TaskManager
+from .workers import WORKERS_ENV
+from .limits import run_with_timeout
 from .utils import http_error
 
+if TYPE_CHECKING:
+    from .pools import AgentPool
+
+
+DISPATCH_POLICIES = ('first', 'round-robin', 'least-busy')
+
+agent_list_adapter = TypeAdapter(List[AgentDescription])
+
 
 class Container:
 
-    def __init__(self, path_to_image_file: str):
+    def __init__(self, path_to_image_file: str, executor: Union[str, Executor] = 'thread', max_workers: Optional[int] = None,
+                 dispatch: str = 'first', batch_concurrency: int = 16, action_timeout: Optional[float] = None,
+                 login_timeout: Optional[float] = 30.0, sessions: Optional[SessionManager] = None,
+                 stable_agent_ids: Optional[bool] = None, tasks: Optional[TaskManager] = None,
+                 max_agents: Optional[int] = 100):
+        if dispatch not in DISPATCH_POLICIES:
+            raise ValueError(f'Unknown dispatch policy "{dispatch}", must be one of {DISPATCH_POLICIES}.')
+
         self.container_id = os.getenv('CONTAINER_ID', '')
         self.platform_url = os.getenv('PLATFORM_URL', '')
         self.token = os.getenv('TOKEN', '')
@@ -21,7 +48,26 @@ class Container:
         self.image: ImageDescription = Container.load_image(path_to_image_file)
         self.agents: Dict[str, AbstractAgent] = {}
         self.started_at: datetime = datetime.utcnow()
-        self.channels: Dict[str, List[AbstractAgent]] = {}
+        self.channels: TopicTree = TopicTree()
+        self.executors: ExecutorPool = ExecutorPool(executor, max_workers)
+        self.dispatch: str = dispatch
+        self.dispatch_counters: Dict[str, int] = {}
+        self.action_index: Dict[str, List[AbstractAgent]] = {}
+        self.stream_index: Dict[str, List[AbstractAgent]] = {}
+        self.description_cache: Dict[str, Tuple[bytes, str]] = {}
+        self.batch_concurrency: int = batch_concurrency
+        self.action_timeout: Optional[float] = action_timeout
+        self.login_timeout: Optional[float] = login_timeout
+        self.sessions: SessionManager = sessions if sessions is not None else SessionManager()
+        self.sessions.on_evict = self.logout_agents
+        self.tasks: TaskManager = tasks if tasks is not None else TaskManager()
+        self.stable_agent_ids: bool = stable_agent_ids if stable_agent_ids is not None else WORKERS_ENV in os.environ
+        self.agent_type_counts: Dict[str, int] = {}
+        self.agent_types: Dict[str, Callable[..., AbstractAgent]] = {}
+        self.spawned_agents: Set[str] = set()
+        self.max_agents: Optional[int] = max_agents
+        self.pools: List['AgentPool'] = []
+        self.platform: PlatformClient = PlatformClient(self.platform_url, self.token)
 
     @staticmethod
     def load_image(json_file: str) -> ImageDescription:
@@ -43,6 +89,17 @@ class Container:
             return self.agents[agent_id]
         raise http_error(400, f'Unknown agentId: {agent_id}.')
 
+    def make_agent_id(self, agent_type: str) -> str:
+        """
+        Generate the ID of a new agent. Random by default; stable IDs are derived from the container ID and the
+        number of agents of the same type created before, so that they are the same in all worker processes.
+        """
+        if not self.stable_agent_ids:
+            return str(uuid.uuid4())
+        index = self.agent_type_counts.get(agent_type, 0)
+        self.agent_type_counts[agent_type] = index + 1
+        return str(uuid.uuid5(uuid.NAMESPACE_URL, f'opaca:{self.container_id}/{agent_type}/{index}'))
+
     def add_agent(self, agent: AbstractAgent):
         """
         Add the agent to this container.
@@ -50,27 +107,182 @@ class Container:
         if not self.has_agent(agent.agent_id):
             self.agents[agent.agent_id] = agent
             agent.container = self
+            for name in agent.actions:
+                self.index_action(name, agent)
+            for name in agent.streams:
+                self.index_stream(name, agent)
+            self.invalidate_descriptions()
 
     def remove_agent(self, agent_id: str):
         """
-        Remove the agent from the container.
+        Remove the agent from the container immediately. Use retire_agent for agents that might be busy.
         """
         if self.has_agent(agent_id):
             agent = self.agents[agent_id]
+            self.detach_agent(agent)
             agent.container = None
-            del self.agents[agent_id]
+
+    def detach_agent(self, agent: AbstractAgent):
+        """
+        Stop routing requests and messages to the agent, while it keeps its reference to the container.
+        """
+        for name in agent.actions:
+            self.unindex_action(name, agent)
+        for name in agent.streams:
+            self.unindex_stream(name, agent)
+        self.channels.unsubscribe_all(agent)
+        del self.agents[agent.agent_id]
+        self.spawned_agents.discard(agent.agent_id)
+        self.invalidate_descriptions()
+
+    async def retire_agent(self, agent_id: str, timeout: Optional[float] = 30.0) -> bool:
+        """
+        Remove the agent from the container without interrupting it: no new requests or messages are routed to
+        the agent, while it finishes the invocations and messages it is already handling. Returns whether the
+        agent finished within the timeout; it is removed either way.
+        """
+        agent = self.get_agent(agent_id)
+        self.detach_agent(agent)
+        try:
+            await asyncio.wait_for(agent.drain(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            agent.inbox.close()
+            agent.container = None
+
+    def register_agent_type(self, factory: Callable[..., AbstractAgent], agent_type: Optional[str] = None):
+        """
+        Register an agent class, or a function creating an agent, so that agents of this type can be spawned
+        at runtime. It is called with the container and the agent ID as keyword arguments.
+        """
+        self.agent_types[agent_type or factory.__name__] = factory
+
+    def spawn_agent(self, agent_type: str, agent_id: str = '') -> AbstractAgent:
+        """
+        Create a new agent of the registered type in this container. The container keeps no credentials,
+        so the agent only takes part in logins made after it was spawned.
+        """
+        if agent_type not in self.agent_types:
+            raise http_error(400, f'Unknown agent type: {agent_type}.')
+        if agent_id and self.has_agent(agent_id):
+            raise http_error(409, f'Agent {agent_id} already exists.')
+        if self.max_agents is not None and len(self.agents) >= self.max_agents:
+            raise http_error(409, f'The container already has the maximum number of {self.max_agents} agents.')
+        agent = self.agent_types[agent_type](container=self, agent_id=agent_id)
+        self.spawned_agents.add(agent.agent_id)
+        return agent
 
     def has_agent(self, agent_id) -> bool:
         return agent_id in self.agents
 
+    def set_executor(self, executor: Union[str, Executor], max_workers: Optional[int] = None):
+        """
+        Change the default executor synchronous actions are run in. Pools already in use are shut down.
+        """
+        self.executors.shutdown(wait=False)
+        self.executors = ExecutorPool(executor, max_workers)
+
+    def index_action(self, name: str, agent: AbstractAgent):
+        """
+        Register the agent as provider of the action with the given name.
+        """
+        agents = self.action_index.setdefault(name, [])
+        if agent not in agents:
+            agents.append(agent)
+        self.invalidate_descriptions()
+
+    def unindex_action(self, name: str, agent: AbstractAgent):
+        """
+        Remove the agent from the providers of the action with the given name.
+        """
+        agents = self.action_index.get(name, [])
+        if agent in agents:
+            agents.remove(agent)
+        if not agents:
+            self.action_index.pop(name, None)
+        self.invalidate_descriptions()
+
+    def index_stream(self, name: str, agent: AbstractAgent):
+        """
+        Register the agent as provider of the stream with the given name.
+        """
+        agents = self.stream_index.setdefault(name, [])
+        if agent not in agents:
+            agents.append(agent)
+        self.invalidate_descriptions()
+
+    def unindex_stream(self, name: str, agent: AbstractAgent):
+        """
+        Remove the agent from the providers of the stream with the given name.
+        """
+        agents = self.stream_index.get(name, [])
+        if agent in agents:
+            agents.remove(agent)
+        if not agents:
+            self.stream_index.pop(name, None)
+        self.invalidate_descriptions()
+
+    def select_agent(self, name: str, agents: List[AbstractAgent]) -> AbstractAgent:
+        """
+        Select one of the agents providing the action or stream with the given name,
+        according to the container's dispatch policy.
+        """
+        if len(agents) == 1 or self.dispatch == 'first':
+            return agents[0]
+        if self.dispatch == 'least-busy':
+            return min(agents, key=lambda agent: agent.in_flight)
+        count = self.dispatch_counters.get(name, 0)
+        self.dispatch_counters[name] = count + 1
+        return agents[count % len(agents)]
+
+    def dispatch_action(self, name: str) -> AbstractAgent:
+        """
+        Select the agent to invoke the action with the given name, according to the container's dispatch policy.
+        """
+        if name not in self.action_index:
+            raise http_error(400, f'Unknown action: {name}.')
+        return self.select_agent(name, self.action_index[name])
+
     async def invoke_action(self, name: str, parameters: Dict[str, Any], login_token: str = None):
         """
         Invoke action on any agent that knows the action.
         """
-        for agent in self.agents.values():
-            if agent.knows_action(name):
-                return await agent.invoke_action(name, parameters, login_token)
-        raise http_error(400, f'Unknown action: {name}.')
+        return await self.dispatch_action(name).invoke_action(name, parameters, login_token)
+
+    async def invoke_action_stream(self, name: str, parameters: Dict[str, Any], login_token: str = None,
+                                   agent_id: Optional[str] = None) -> AsyncIterator[Any]:
+        """
+        Invoke a streaming action on the specified agent or any agent that knows the action,
+        returning an async iterator over its partial results.
+        """
+        agent = self.get_agent(agent_id) if agent_id is not None else self.dispatch_action(name)
+        return await agent.invoke_action_stream(name, parameters, login_token)
+
+    def get_action(self, name: str, agent_id: Optional[str] = None) -> Optional[ActionDescription]:
+        """
+        Get the description of the action of the specified agent, or of the first agent providing it.
+        """
+        if agent_id is not None:
+            return self.agents[agent_id].get_action(name) if self.has_agent(agent_id) else None
+        agents = self.action_index.get(name)
+        return agents[0].get_action(name) if agents else None
+
+    def get_action_stats(self) -> Dict[str, Dict[str, Dict[str, int]]]:
+        """
+        Get runtime statistics of the actions of all agents, by agent ID and action name.
+        """
+        return {agent_id: stats for agent_id, agent in self.agents.items() if (stats := agent.get_action_stats())}
+
+    def purge_cache(self, name: str) -> int:
+        """
+        Remove all cached results of the action with the given name, returning the number of removed results.
+        """
+        if name not in self.action_index:
+            raise http_error(400, f'Unknown action: {name}.')
+        actions = [agent.get_action(name) for agent in self.action_index[name]]
+        return sum(action.cache.purge() for action in actions if action.cache is not None)
 
     async def invoke_agent_action(self, name: str, agent_id: str, parameters: Dict[str, Any], login_token: str = None):
         """
@@ -80,72 +292,143 @@ class Container:
             return await self.get_agent(agent_id).invoke_action(name, parameters, login_token)
         raise http_error(400, f'Unknown agent: {agent_id}.')
 
-    def invoke_stream(self, name: str, mode: StreamDescription.Mode, login_token: str = None):
+    async def invoke_batch(self, invocations: List[BatchInvocation], login_token: str = None,
+                           max_concurrency: Optional[int] = None) -> List[BatchResult]:
+        """
+        Invoke all the given actions concurrently and return their results and errors in input order.
+        """
+        results = [result async for result in self.invoke_batch_iter(invocations, login_token, max_concurrency)]
+        return sorted(results, key=lambda result: result.index)
+
+    async def invoke_batch_iter(self, invocations: List[BatchInvocation], login_token: str = None,
+                                max_concurrency: Optional[int] = None) -> AsyncIterator[BatchResult]:
+        """
+        Invoke all the given actions concurrently, with at most max_concurrency (defaulting to the container's
+        batch_concurrency) running at the same time, and yield the results in order of completion.
+        """
+        from fastapi import HTTPException
+        semaphore = asyncio.Semaphore(min(max_concurrency or self.batch_concurrency, self.batch_concurrency))
+
+        async def invoke(index: int, invocation: BatchInvocation) -> BatchResult:
+            async with semaphore:
+                try:
+                    parameters = dict(invocation.parameters)
+                    if invocation.agentId is None:
+                        result = await self.invoke_action(invocation.action, parameters, login_token)
+                    else:
+                        result = await self.invoke_agent_action(invocation.action, invocation.agentId, parameters, login_token)
+                    return BatchResult(index=index, result=result)
+                except HTTPException as e:
+                    return BatchResult(index=index, error={'status': e.status_code, 'detail': e.detail})
+                except Exception as e:
+                    return BatchResult(index=index, error={'status': 500, 'detail': {'cause': str(e)}})
+
+        tasks = [asyncio.create_task(invoke(i, invocation)) for i, invocation in enumerate(invocations)]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield await task
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def invoke_stream(self, name: str, mode: StreamDescription.Mode, login_token: str = None, body: Optional[AsyncIterator[bytes]] = None):
         """
         GET a stream from or POST a stream to any agent that knows the stream.
         """
-        for agent in self.agents.values():
-            if agent.knows_stream(name):
-                return agent.invoke_stream(name, mode, login_token)
-        raise http_error(400, f'Unknown stream: {name}.')
+        if name not in self.stream_index:
+            raise http_error(400, f'Unknown stream: {name}.')
+        agent = self.select_agent(name, self.stream_index[name])
+        return agent.invoke_stream(name, mode, login_token, body)
 
-    def invoke_agent_stream(self, name: str, mode: StreamDescription.Mode, agent_id: str = '', login_token: str = None) -> bytes:
+    def get_stream(self, name: str, agent_id: Optional[str] = None) -> Optional[StreamDescription]:
+        """
+        Get the description of the stream of the specified agent, or of the first agent providing it.
+        """
+        if agent_id is not None:
+            return self.agents[agent_id].get_stream(name) if self.has_agent(agent_id) else None
+        agents = self.stream_index.get(name)
+        return agents[0].get_stream(name) if agents else None
+
+    def invoke_agent_stream(self, name: str, mode: StreamDescription.Mode, agent_id: str = '', login_token: str = None,
+                            body: Optional[AsyncIterator[bytes]] = None):
         """
         GET a stream from or POST a stream to the specified agent.
         """
         if self.has_agent(agent_id):
-            return self.get_agent(agent_id).invoke_stream(name, mode, login_token)
+            return self.get_agent(agent_id).invoke_stream(name, mode, login_token, body)
         raise http_error(400, f'Unknown agent: {agent_id}.')
 
     def send_message(self, agent_id: str, message: Message):
         """
-        Send a message to the specified agent.
+        Put a message into the inbox of the specified agent.
         """
         agent = self.get_agent(agent_id)
         if agent is not None:
-            agent.receive_message(message)
+            agent.inbox.put(message)
 
     def subscribe_channel(self, channel: str, agent: AbstractAgent):
         """
-        Subscribe an agent to the specified channel.
+        Subscribe an agent to the specified channel, which may be a pattern with wildcards, e.g. "sensors/*/temperature".
         """
-        if channel not in self.channels:
-            self.channels[channel] = []
-        if agent not in self.channels[channel]:
-            self.channels[channel].append(agent)
+        self.channels.subscribe(channel, agent)
 
     def unsubscribe_channel(self, channel: str, agent: AbstractAgent):
         """
         Unsubscribe an agent from the specified channel.
         """
-        if channel not in self.channels:
-            return
-        if agent not in self.channels[channel]:
-            return
-        self.channels[channel].remove(agent)
+        self.channels.unsubscribe(channel, agent)
 
     def broadcast(self, channel: str, message: Message):
         """
-        Broadcast a message to all agents subscribing to the specified channel.
+        Put a message into the inboxes of all agents subscribing to the specified channel or a matching pattern.
+        Subscribers whose inbox is full and rejects messages do not receive the message.
+        """
+        for agent in self.channels.match(channel):
+            agent.inbox.offer(message)
+
+    async def fan_out(self, agents: List[AbstractAgent], func: Callable[[AbstractAgent], Any]) -> List[Optional[BaseException]]:
+        """
+        Call the async function for all given agents concurrently, each with the login timeout,
+        and return the exception raised for each agent, or None if it succeeded.
         """
-        if channel not in self.channels:
-            return
-        for agent in self.channels[channel]:
-            agent.receive_message(message)
+        results = await asyncio.gather(*(run_with_timeout(lambda agent=agent: func(agent), self.login_timeout)
+                                         for agent in agents), return_exceptions=True)
+        return [result if isinstance(result, BaseException) else None for result in results]
 
     async def handle_login(self, login: Login) -> str:
+        """
+        Log in to all agents concurrently. If any agent fails to log in, the agents that already succeeded are
+        logged out again, so that no agent is left holding the token, and the first error is raised.
+        """
         token = str(uuid.uuid4())
-        for agent in self.agents.values():
-            await agent.handle_login(LoginMsg(token=token, login=login))
+        agents = list(self.agents.values())
+        errors = await self.fan_out(agents, lambda agent: agent.handle_login(LoginMsg(token=token, login=login)))
+        if any(errors):
+            succeeded = [agent for agent, error in zip(agents, errors) if error is None]
+            await self.fan_out(succeeded, lambda agent: agent.handle_logout(token))
+            raise next(error for error in errors if error is not None)
+        await self.sessions.create(token)
         return token
 
     async def handle_logout(self, login_token: str = None) -> bool:
+        """
+        End the session and log out from all agents.
+        """
         if not login_token:
             return False
-        for agent in self.agents.values():
-            await agent.handle_logout(login_token)
+        await self.sessions.remove(login_token)
+        await self.logout_agents(login_token)
         return True
 
+    async def logout_agents(self, login_token: str):
+        """
+        Log out from all agents concurrently. All agents are logged out even if some of them fail,
+        in which case the first error is raised afterwards.
+        """
+        errors = await self.fan_out(list(self.agents.values()), lambda agent: agent.handle_logout(login_token))
+        if any(errors):
+            raise next(error for error in errors if error is not None)
+
     def get_description(self) -> ContainerDescription:
         return ContainerDescription(
             containerId=self.container_id,
@@ -160,6 +443,32 @@ class Container:
     def get_agent_descriptions(self) -> List[AgentDescription]:
         return [agent.make_description() for agent in self.agents.values()]
 
+    def invalidate_descriptions(self):
+        """
+        Clear the cached descriptions. This is done automatically whenever agents, actions or streams
+        are added or removed, but has to be called manually if e.g. an agent's description is changed.
+        """
+        self.description_cache.clear()
+
+    def get_cached(self, key: str, build: Callable[[], bytes]) -> Tuple[bytes, str]:
+        """
+        Get the serialized JSON body and ETag for the given key, building it if not cached.
+        """
+        if key not in self.description_cache:
+            body = build()
+            self.description_cache[key] = (body, f'"{hashlib.sha1(body).hexdigest()}"')
+        return self.description_cache[key]
+
+    def get_description_json(self) -> Tuple[bytes, str]:
+        return self.get_cached('info', lambda: self.get_description().model_dump_json().encode())
+
+    def get_agent_descriptions_json(self) -> Tuple[bytes, str]:
+        return self.get_cached('agents', lambda: agent_list_adapter.dump_json(self.get_agent_descriptions()))
+
+    def get_agent_description_json(self, agent_id: str) -> Tuple[bytes, str]:
+        agent = self.get_agent(agent_id)
+        return self.get_cached(f'agents/{agent_id}', lambda: agent.make_description().model_dump_json().encode())
+
     def get_running_since(self):
         return f'{self.started_at.isoformat(timespec="milliseconds")}Z'
 
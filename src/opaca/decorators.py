@@ -2,85 +2,126 @@ import ast
 import textwrap
 import inspect
 import re
-from typing import (Optional, Callable, get_type_hints, Dict,
+from concurrent.futures import Executor
+from typing import (Optional, Callable, get_type_hints, Dict, List,
                     Tuple, Any, Union, get_origin, get_args, TYPE_CHECKING)
+from types import MethodType
+from weakref import WeakKeyDictionary
 
 from .models import StreamDescription, Parameter
+from .executors import check_executor
+from .caching import CachePolicy
+from .validation import make_validator
+from .arrays import is_array_hint, get_dtype, get_shape, get_items_type
 
 if TYPE_CHECKING:
     from .abstract_agent import AbstractAgent
 
 
-def action(_func: Optional[Callable] = None, *, name: str = '', description: str = '', auth: bool = False):
+def action(_func: Optional[Callable] = None, *, name: str = '', description: str = '', auth: bool = False,
+           executor: Union[str, Executor, None] = None, cache: Optional[CachePolicy] = None,
+           coalesce: bool = False, max_concurrency: Optional[int] = None, queue_size: Optional[int] = None,
+           timeout: Optional[float] = None, streaming: bool = False, background: bool = False):
+    check_executor(executor)
+    if queue_size is not None and max_concurrency is None:
+        raise ValueError('queue_size can only be used together with max_concurrency.')
+
     def decorator(func: Callable):
+        if streaming and not (inspect.isgeneratorfunction(func) or inspect.isasyncgenfunction(func)):
+            raise TypeError(f'The method {func.__name__} was declared with "streaming" and therefore needs to be '
+                            f'a generator or async generator.')
         func._is_action = True
         func._name = name
         func._description = description
         func._auth = auth
+        func._executor = executor
+        func._cache = cache
+        func._coalesce = coalesce
+        func._max_concurrency = max_concurrency
+        func._queue_size = queue_size
+        func._timeout = timeout
+        func._streaming = streaming
+        func._background = background
         return func
 
     return decorator(_func) if _func else decorator
 
 
-def stream(*, mode: StreamDescription.Mode, name: str = '', description: str = '', auth: bool = False):
+def stream(*, mode: StreamDescription.Mode, name: str = '', description: str = '', auth: bool = False,
+           media_type: Optional[str] = None, chunk_size: Optional[int] = None, flush_interval: Optional[float] = None):
     def decorator(func: Callable):
         func._is_stream = True
         func._mode = mode
         func._name = name
         func._description = description
         func._auth = auth
+        func._media_type = media_type
+        func._chunk_size = chunk_size
+        func._flush_interval = flush_interval
         return func
 
     return decorator
 
 
-def register_actions(agent: 'AbstractAgent') -> None:
-    """
-    Auto-register actions marked by decorator.
-    """
-    for name, func in inspect.getmembers(agent, predicate=inspect.ismethod):
-        if not getattr(func, '_is_action', False):
-            continue
-
-        params, return_type = parse_params(func)
-        action_name = parse_name(func, name)
-        description = parse_description(func)
-
-        if getattr(func, '_auth', False):
-            check_for_token(action_name, params)
+registrations: WeakKeyDictionary = WeakKeyDictionary()
 
-        agent.add_action(
-            name=action_name,
-            description=description,
-            parameters=params,
-            result=return_type,
-            callback=getattr(agent, name),
-        )
 
-
-def register_streams(agent: 'AbstractAgent') -> None:
+def get_registrations(cls: type) -> List[Tuple[str, str, Dict[str, Any]]]:
     """
-    Auto-register streams marked by decorator.
+    Inspect the actions and streams marked by decorators in the agent class, returning the kind, attribute
+    name and arguments for adding each of them. The result is computed once per class and shared by all instances.
     """
-    for name, func in inspect.getmembers(agent, predicate=inspect.ismethod):
-        if not getattr(func, '_is_stream', False):
-            continue
-
-        params, return_type = parse_params(func)
-        stream_name = parse_name(func, name)
-        description = parse_description(func)
+    if cls in registrations:
+        return registrations[cls]
 
-        if getattr(func, '_auth', False):
-            check_for_token(stream_name, params)
-
-        mode = getattr(func, '_mode', '')
-
-        agent.add_stream(
-            name=stream_name,
-            description=description,
-            mode=mode,
-            callback=getattr(agent, name),
-        )
+    actions, streams = [], []
+    for name, func in inspect.getmembers(cls, predicate=inspect.isroutine):
+        if isinstance(inspect.getattr_static(cls, name), staticmethod):
+            continue
+        if inspect.isfunction(func):
+            # bind to the class, so that the signature does not include "self"
+            func = MethodType(func, cls)
+        if getattr(func, '_is_action', False):
+            params, return_type = parse_params(func)
+            action_name = parse_name(func, name)
+            if getattr(func, '_auth', False):
+                check_for_token(action_name, params)
+            if getattr(func, '_streaming', False):
+                return_type = parse_streaming_result(func)
+            actions.append(('action', name, dict(
+                name=action_name,
+                description=parse_description(func),
+                parameters=params,
+                result=return_type,
+                validator=make_validator(action_name, params, func),
+            )))
+        elif getattr(func, '_is_stream', False):
+            params, _ = parse_params(func)
+            stream_name = parse_name(func, name)
+            if getattr(func, '_auth', False):
+                check_for_token(stream_name, params)
+            streams.append(('stream', name, dict(
+                name=stream_name,
+                description=parse_description(func),
+                mode=getattr(func, '_mode', ''),
+                media_type=getattr(func, '_media_type', None),
+                chunk_size=getattr(func, '_chunk_size', None),
+                flush_interval=getattr(func, '_flush_interval', None),
+            )))
+
+    registrations[cls] = actions + streams
+    return registrations[cls]
+
+
+def register_members(agent: 'AbstractAgent') -> None:
+    """
+    Auto-register actions and streams marked by decorator.
+    """
+    for kind, name, arguments in get_registrations(type(agent)):
+        if kind == 'action':
+            agent.add_action(callback=getattr(agent, name), **{**arguments, 'parameters': dict(arguments['parameters'])})
+        else:
+            agent.add_stream(callback=getattr(agent, name), **arguments)
 
 
 def check_for_token(name: str, params: Dict[str, Parameter]):
@@ -146,6 +187,17 @@ def parse_params(func: Callable) -> Tuple[Dict[str, Parameter], Parameter]:
     return params, return_type
 
 
+def parse_streaming_result(func: Callable) -> Parameter:
+    """
+    Parse the return type of a streaming action, e.g. Iterator[str] or AsyncGenerator[int, None],
+    into the type of its aggregated result, i.e. a list of the yielded items.
+    """
+    args = get_args(get_type_hints(func).get('return', None))
+    if not args or args[0] is Any:
+        return Parameter(type="array")
+    return python_type_to_parameter(list[args[0]])
+
+
 def parse_name(func: Callable, func_name: str) -> str:
     """
     Parse the name of the decorated function into a proper action/stream name.
@@ -229,6 +281,17 @@ def resolve_array_items(hint: Any) -> Parameter.ArrayItems:
         return Parameter.ArrayItems(type=type_mapping.get(origin, hint.__name__))
 
 
+def array_to_parameter(hint: Any, required: bool = True) -> Parameter:
+    """
+    Describe a NumPy array type hint as an array parameter, nested as deeply as it has dimensions.
+    """
+    dtype, shape = get_dtype(hint), get_shape(hint)
+    items = Parameter.ArrayItems(type=get_items_type(dtype))
+    for _ in range(len(shape) - 1 if shape else 0):
+        items = Parameter.ArrayItems(type="array", items=items)
+    return Parameter(type="array", required=required, items=items, dtype=dtype, shape=shape)
+
+
 def python_type_to_parameter(hint: Any, default: Any = inspect.Parameter.empty) -> Any:
     """
     This method takes in parameter information and transforms it into a Parameter instance.
@@ -239,6 +302,12 @@ def python_type_to_parameter(hint: Any, default: Any = inspect.Parameter.empty)
 
     required = default is inspect.Parameter.empty
 
+    # Handle NumPy arrays, described as (nested) arrays with their dtype and shape
+    if is_array_hint(hint):
+        return array_to_parameter(hint, required)
+    if origin is Union and len(args) == 2 and type(None) in args and any(is_array_hint(arg) for arg in args):
+        return array_to_parameter(next(arg for arg in args if arg is not type(None)), False)
+
     # Handle NoneType
     if hint is None:
         _type = "null"
@@ -248,6 +317,8 @@ def python_type_to_parameter(hint: Any, default: Any = inspect.Parameter.empty)
         for arg in args:
             if arg is type(None):
                 required = False
+            elif is_array_hint(arg):
+                types.append("array")
             else:
                 t = type_mapping.get(get_origin(arg), "object")
                 types.append(t)
@@ -0,0 +1,146 @@
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor, Future
+from typing import Dict, Any, Callable, Optional, Union, List, Tuple
+
+
+EXECUTOR_TYPES = ('inline', 'thread', 'process')
+
+cancel_event: contextvars.ContextVar[Optional[threading.Event]] = contextvars.ContextVar('cancel_event', default=None)
+
+
+def is_cancelled() -> bool:
+    """
+    Check whether the invocation of the current synchronous action has been cancelled, e.g. because the client
+    disconnected or the timeout passed. Long-running actions running in a thread can use this to stop early.
+    """
+    event = cancel_event.get()
+    return event is not None and event.is_set()
+
+
+class WorkTracker:
+    """
+    Keeps track of the callbacks submitted to executors while it is active, also in nested invocations.
+    Cancelling an invocation does not stop a callback that is already running in a thread or process,
+    so resources like concurrency slots should only be released once those callbacks have actually finished.
+    """
+
+    def __init__(self):
+        self.futures: List[Future] = []
+        self.token: Optional[contextvars.Token] = None
+
+    def __enter__(self) -> 'WorkTracker':
+        self.token = running_work.set(running_work.get() + (self,))
+        return self
+
+    def __exit__(self, *exc_info):
+        running_work.reset(self.token)
+
+    def when_done(self, callback: Callable[[], Any]):
+        """
+        Call the callback on the event loop once all tracked callbacks have finished, right away if they have.
+        """
+        pending = [future for future in self.futures if not future.done()]
+        if not pending:
+            callback()
+            return
+        waiter = asyncio.gather(*(asyncio.wrap_future(future) for future in pending), return_exceptions=True)
+        waiter.add_done_callback(lambda _: callback())
+
+
+running_work: contextvars.ContextVar[Tuple[WorkTracker, ...]] = contextvars.ContextVar('running_work', default=())
+
+
+def track_work(future: Future) -> Future:
+    """
+    Register the future of a callback running in a thread or process with all active work trackers.
+    """
+    for tracker in running_work.get():
+        tracker.futures.append(future)
+    return future
+
+
+def check_executor(executor: Union[str, Executor, None]) -> None:
+    """
+    Raise an error if the given executor is neither a known executor type nor an Executor instance.
+    """
+    if executor is None or isinstance(executor, Executor):
+        return
+    if executor not in EXECUTOR_TYPES:
+        raise ValueError(f'Unknown executor "{executor}", must be one of {EXECUTOR_TYPES} or an Executor instance.')
+
+
+class ExecutorPool:
+    """
+    Lazily creates and holds the worker pools that synchronous action callbacks are run in,
+    so that they do not block the event loop serving all other requests of the container.
+    """
+
+    def __init__(self, default: Union[str, Executor] = 'thread', max_workers: Optional[int] = None):
+        check_executor(default)
+        self.default: Union[str, Executor] = default
+        self.max_workers: Optional[int] = max_workers
+        self.executors: Dict[str, Executor] = {}
+
+    def get_executor(self, kind: str) -> Executor:
+        """
+        Get the pool for the given executor type, creating it on first use.
+        """
+        if kind not in self.executors:
+            if kind == 'process':
+                self.executors[kind] = ProcessPoolExecutor(max_workers=self.max_workers or os.cpu_count())
+            else:
+                self.executors[kind] = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='opaca')
+        return self.executors[kind]
+
+    def get_thread_executor(self, executor: Union[str, Executor, None] = None) -> Executor:
+        """
+        Get the requested executor, falling back to the default executor of this pool, for running a synchronous
+        generator in one of its threads. The items of generators are handed over in memory and they must not
+        block the event loop while they are iterated, so process pools and 'inline' use the thread pool instead.
+        """
+        executor = executor or self.default
+        if isinstance(executor, Executor) and not isinstance(executor, ProcessPoolExecutor):
+            return executor
+        return self.get_executor('thread')
+
+    async def run(self, callback: Callable, parameters: Dict[str, Any], executor: Union[str, Executor, None] = None) -> Any:
+        """
+        Run the synchronous callback with the given parameters in the requested executor,
+        falling back to the default executor of this pool. Callbacks in a thread pool are signalled via
+        `is_cancelled()` when the invocation is cancelled, otherwise their result is just abandoned.
+        """
+        executor = executor or self.default
+        if executor == 'inline':
+            return callback(**parameters)
+        if not isinstance(executor, Executor):
+            executor = self.get_executor(executor)
+        if isinstance(executor, ProcessPoolExecutor):
+            return await self.submit(executor, functools.partial(callback, **parameters))
+
+        event = threading.Event()
+        context = contextvars.copy_context()
+        context.run(cancel_event.set, event)
+        try:
+            return await self.submit(executor, functools.partial(context.run, callback, **parameters))
+        except asyncio.CancelledError:
+            event.set()
+            raise
+
+    @staticmethod
+    def submit(executor: Executor, func: Callable[[], Any]) -> asyncio.Future:
+        """
+        Submit the function to the executor, registering it with all active work trackers.
+        """
+        return asyncio.wrap_future(track_work(executor.submit(func)))
+
+    def shutdown(self, wait: bool = True) -> None:
+        """
+        Shut down all pools created so far. They will be re-created if needed again.
+        """
+        for executor in self.executors.values():
+            executor.shutdown(wait=wait)
+        self.executors.clear()
@@ -0,0 +1,136 @@
+import asyncio
+import logging
+import threading
+from collections import deque
+from inspect import iscoroutinefunction
+from typing import Deque, Callable, Optional
+
+from .models import Message
+from .utils import http_error
+
+
+OVERFLOW_POLICIES = ('drop-oldest', 'drop-newest', 'reject')
+
+logger = logging.getLogger(__name__)
+
+
+def get_running_loop() -> Optional[asyncio.AbstractEventLoop]:
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+
+class Inbox:
+    """
+    Bounded queue of messages sent to an agent, which are handed to the agent's message handler one after
+    another by a background worker task, so that senders only wait until the message is enqueued.
+
+    The worker is started when a message is put into the empty inbox and finishes once the inbox is empty again.
+    Async handlers are awaited, synchronous handlers are called directly on the event loop, so they should be quick.
+    Messages can also be put into the inbox from other threads, e.g. by synchronous actions running in the thread
+    pool; the worker is then started on the event loop the inbox was started on.
+
+    :param handler: Function called with each message, usually the agent's `receive_message` method.
+    :param max_size: Maximum number of messages waiting to be handled.
+    :param overflow: What to do with a new message if the inbox is full: drop the oldest waiting message,
+        drop the new message, or reject it with a 429 error.
+    """
+
+    def __init__(self, handler: Callable[[Message], None], max_size: int = 1000, overflow: str = 'drop-oldest'):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f'Unknown overflow policy "{overflow}", must be one of {OVERFLOW_POLICIES}.')
+        if max_size < 1:
+            raise ValueError('max_size must be at least 1.')
+        self.handler: Callable[[Message], None] = handler
+        self.max_size: int = max_size
+        self.overflow: str = overflow
+        self.queue: Deque[Message] = deque()
+        self.lock: threading.Lock = threading.Lock()
+        self.worker: Optional[asyncio.Task] = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = get_running_loop()
+        self.dropped: int = 0
+        self.failed: int = 0
+
+    def put(self, message: Message) -> bool:
+        """
+        Enqueue the message, applying the overflow policy if the inbox is full. Returns whether the message
+        was enqueued, or raises a 429 error if it was rejected. Can be called from any thread.
+        """
+        if not self.offer(message) and self.overflow == 'reject':
+            raise http_error(429, 'Inbox of the agent is full.', {'Retry-After': '1'})
+        return True
+
+    def offer(self, message: Message) -> bool:
+        """
+        Like put, but returning False instead of raising an error if the message is rejected.
+        """
+        with self.lock:
+            if len(self.queue) >= self.max_size:
+                self.dropped += 1
+                if self.overflow != 'drop-oldest':
+                    return False
+                self.queue.popleft()
+            self.queue.append(message)
+        running_loop = get_running_loop()
+        if self.loop is None:
+            if running_loop is None:
+                raise RuntimeError('The inbox has to be started on an event loop before messages are put into it from other threads.')
+            self.loop = running_loop
+        if running_loop is self.loop:
+            self.start_worker()
+        else:
+            self.loop.call_soon_threadsafe(self.start_worker)
+        return True
+
+    def start(self, loop: Optional[asyncio.AbstractEventLoop] = None):
+        """
+        Start the inbox on the given or the running event loop, on which its worker handles the messages.
+        Inboxes created or used on an event loop are started on it automatically.
+        """
+        self.loop = loop or asyncio.get_running_loop()
+        self.start_worker()
+
+    def start_worker(self):
+        if self.worker is None and self.queue:
+            self.worker = self.loop.create_task(self.work())
+
+    async def work(self):
+        try:
+            while True:
+                with self.lock:
+                    if not self.queue:
+                        break
+                    message = self.queue.popleft()
+                try:
+                    if iscoroutinefunction(self.handler):
+                        await self.handler(message)
+                    else:
+                        self.handler(message)
+                except Exception:
+                    self.failed += 1
+                    logger.exception('Failed to handle message %s', message)
+        finally:
+            if self.worker is asyncio.current_task():
+                self.worker = None
+
+    async def join(self):
+        """
+        Wait until all messages currently in the inbox have been handled.
+        """
+        while self.worker is not None or self.queue:
+            if self.worker is not None:
+                await asyncio.shield(self.worker)
+            else:
+                # the worker is about to be started for a message put into the inbox from another thread
+                await asyncio.sleep(0)
+
+    def close(self):
+        """
+        Stop the worker, discarding all messages not handled yet.
+        """
+        with self.lock:
+            self.queue.clear()
+        if self.worker is not None:
+            self.worker.cancel()
+            self.worker = None
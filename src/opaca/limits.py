@@ -0,0 +1,149 @@
+import asyncio
+import math
+import time
+from contextvars import ContextVar
+from typing import Any, Callable, Awaitable, Optional, AsyncIterator
+
+from .executors import WorkTracker
+from .streams import ClosingIterator
+from .utils import http_error
+
+
+request_deadline: ContextVar[Optional[float]] = ContextVar('request_deadline', default=None)
+
+
+def remaining_time(timeout: Optional[float] = None) -> Optional[float]:
+    """
+    Get the seconds left until the deadline of the current request, if any, capped to the given timeout.
+    """
+    deadline = request_deadline.get()
+    if deadline is None:
+        return timeout
+    remaining = deadline - time.monotonic()
+    return remaining if timeout is None else min(timeout, remaining)
+
+
+async def run_with_timeout(func: Callable[[], Awaitable[Any]], timeout: Optional[float]) -> Any:
+    """
+    Run the function, cancelling it and raising a 504 error if it does not finish within the timeout.
+    """
+    if timeout is None:
+        return await func()
+    try:
+        return await asyncio.wait_for(func(), max(timeout, 0))
+    except asyncio.TimeoutError:
+        raise http_error(504, f'Invocation did not finish within {timeout:.3g} seconds.')
+
+
+class ConcurrencyLimiter:
+    """
+    Limits how many invocations of an action run at the same time. Further invocations wait in a queue
+    of bounded size; once the queue is full, invocations are rejected immediately with a 429 error.
+    A slot is only freed once the callback has actually finished, even if the invocation timed out before.
+
+    :param max_concurrency: Maximum number of concurrently running invocations.
+    :param queue_size: Maximum number of invocations waiting for a free slot, unlimited if None.
+    """
+
+    def __init__(self, max_concurrency: int, queue_size: Optional[int] = None):
+        if max_concurrency < 1:
+            raise ValueError('max_concurrency must be at least 1.')
+        if queue_size is not None and queue_size < 0:
+            raise ValueError('queue_size must not be negative.')
+        self.max_concurrency: int = max_concurrency
+        self.queue_size: Optional[int] = queue_size
+        self.semaphore: asyncio.Semaphore = asyncio.Semaphore(max_concurrency)
+        self.running: int = 0
+        self.waiting: int = 0
+        self.rejected: int = 0
+        self.avg_duration: float = 1.0
+
+    def retry_after(self) -> str:
+        """
+        Estimate in how many seconds a slot might be free again, based on the average duration of invocations.
+        """
+        slots = self.max_concurrency
+        return str(max(1, math.ceil(self.avg_duration * (self.waiting + slots) / slots)))
+
+    async def run(self, func: Callable[[], Awaitable[Any]], timeout: Optional[float] = None) -> Any:
+        """
+        Run the function as soon as a slot is free, or raise an error if the queue is full or the timeout,
+        which includes the time waiting in the queue, has passed.
+        """
+        started_at = time.monotonic()
+        running_since = await self.acquire(timeout)
+        tracker = WorkTracker()
+        try:
+            with tracker:
+                return await run_with_timeout(func, None if timeout is None else timeout - (running_since - started_at))
+        finally:
+            # synchronous callbacks keep running in their thread when the invocation is cancelled or times out
+            tracker.when_done(lambda: self.release(running_since))
+
+    async def acquire(self, timeout: Optional[float] = None) -> float:
+        """
+        Wait for a free slot, or raise an error if the queue is full or the timeout has passed.
+        Returns the time since which the slot is taken, to be passed to release.
+        """
+        if self.semaphore.locked() and self.queue_size is not None and self.waiting >= self.queue_size:
+            self.rejected += 1
+            raise http_error(429, 'Too many concurrent invocations.', {'Retry-After': self.retry_after()})
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self.semaphore.acquire(), None if timeout is None else max(timeout, 0))
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise http_error(503, 'Timed out waiting for a free slot.', {'Retry-After': self.retry_after()})
+        finally:
+            self.waiting -= 1
+        self.running += 1
+        return time.monotonic()
+
+    def release(self, running_since: float):
+        self.running -= 1
+        self.avg_duration = 0.9 * self.avg_duration + 0.1 * (time.monotonic() - running_since)
+        self.semaphore.release()
+
+
+class LimitedIterator(ClosingIterator):
+    """
+    Iterates the partial results of a streaming action, raising a 504 error once the deadline has passed.
+    The concurrency slot of the action, if any, is held until the results are exhausted or closed and all
+    callbacks producing them in a thread have finished.
+
+    :param source: The partial results of the action.
+    :param timeout: Seconds within which the action must have produced all results, if any.
+    :param started_at: Monotonic time the invocation started at, including the time waiting for a slot.
+    :param limiter: The concurrency limiter of the action, whose slot was already acquired, if any.
+    :param running_since: The time returned by the limiter when acquiring the slot.
+    :param on_done: Optional function called once the slot is released, or would be if there was one.
+    """
+
+    def __init__(self, source: AsyncIterator[Any], timeout: Optional[float] = None, started_at: Optional[float] = None,
+                 limiter: Optional[ConcurrencyLimiter] = None, running_since: Optional[float] = None,
+                 on_done: Optional[Callable[[], Any]] = None):
+        super().__init__(source, self.release)
+        self.timeout: Optional[float] = timeout
+        self.started_at: float = started_at if started_at is not None else time.monotonic()
+        self.limiter: Optional[ConcurrencyLimiter] = limiter
+        self.running_since: Optional[float] = running_since
+        self.on_done: Optional[Callable[[], Any]] = on_done
+        self.tracker: WorkTracker = WorkTracker()
+
+    async def next_item(self) -> Any:
+        with self.tracker:
+            if self.timeout is None:
+                return await self.source.__anext__()
+            try:
+                return await asyncio.wait_for(self.source.__anext__(), max(self.started_at + self.timeout - time.monotonic(), 0))
+            except asyncio.TimeoutError:
+                raise http_error(504, f'Invocation did not finish within {self.timeout:.3g} seconds.')
+
+    def release(self, error: Optional[BaseException]):
+        self.tracker.when_done(self.done)
+
+    def done(self):
+        if self.limiter is not None:
+            self.limiter.release(self.running_since)
+        if self.on_done is not None:
+            self.on_done()
@@ -0,0 +1,145 @@
+import asyncio
+import time
+from bisect import bisect_left
+from typing import Dict, List, Tuple, Any, AsyncIterator
+
+from fastapi import HTTPException
+
+from .streams import ClosingIterator
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def get_status(error: BaseException) -> int:
+    """
+    Get the response status to record for an invocation that raised the error.
+    """
+    if isinstance(error, HTTPException):
+        return error.status_code
+    if isinstance(error, (asyncio.CancelledError, GeneratorExit)):
+        return 499
+    return 500
+
+
+class Metrics:
+    """
+    Collects request counts, latencies, in-flight requests and message and stream volumes of a container
+    and renders them in the Prometheus text format. All metrics are only ever updated from the event loop,
+    so plain dict and int operations suffice and no locks are needed in the hot path.
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets: Tuple[float, ...] = buckets
+        self.requests: Dict[Tuple[str, str, int], int] = {}
+        self.histograms: Dict[Tuple[str, str], List[float]] = {}
+        self.in_flight: Dict[Tuple[str, str], int] = {}
+        self.bytes_streamed: Dict[str, int] = {}
+        self.broadcasts: Dict[str, int] = {}
+        self.messages: Dict[str, int] = {}
+
+    async def measure(self, kind: str, name: str, awaitable) -> Any:
+        """
+        Await the invocation of the action or stream with the given name, recording its status and latency.
+        """
+        started_at = self.start(kind, name)
+        status = 200
+        try:
+            return await awaitable
+        except BaseException as e:
+            status = get_status(e)
+            raise
+        finally:
+            self.finish(kind, name, status, started_at)
+
+    def measure_iter(self, kind: str, name: str, iterator: AsyncIterator[Any], started_at: float) -> AsyncIterator[Any]:
+        """
+        Iterate the results of a stream or streaming action, recording its status and latency once it is exhausted,
+        failed or was closed, e.g. because the client disconnected.
+        """
+        return ClosingIterator(iterator, lambda error: self.finish(kind, name, 200 if error is None else get_status(error), started_at))
+
+    def start(self, kind: str, name: str) -> float:
+        self.in_flight[(kind, name)] = self.in_flight.get((kind, name), 0) + 1
+        return time.perf_counter()
+
+    def finish(self, kind: str, name: str, status: int, started_at: float):
+        self.in_flight[(kind, name)] -= 1
+        self.observe(kind, name, status, time.perf_counter() - started_at)
+
+    def observe(self, kind: str, name: str, status: int, duration: float):
+        self.requests[(kind, name, status)] = self.requests.get((kind, name, status), 0) + 1
+        histogram = self.histograms.get((kind, name))
+        if histogram is None:
+            # one counter per bucket plus +Inf, followed by the sum of all durations
+            histogram = self.histograms[(kind, name)] = [0] * (len(self.buckets) + 2)
+        histogram[bisect_left(self.buckets, duration)] += 1
+        histogram[-1] += duration
+
+    def count_stream(self, name: str, size: int):
+        self.bytes_streamed[name] = self.bytes_streamed.get(name, 0) + size
+
+    def count_broadcast(self, channel: str):
+        self.broadcasts[channel] = self.broadcasts.get(channel, 0) + 1
+
+    def count_message(self, agent_id: str):
+        self.messages[agent_id] = self.messages.get(agent_id, 0) + 1
+
+    def render(self) -> str:
+        """
+        Render all metrics in the Prometheus text exposition format.
+        """
+        lines = [
+            '# HELP opaca_requests_total Number of invocations by kind, name and response status.',
+            '# TYPE opaca_requests_total counter',
+        ]
+        for (kind, name, status), count in self.requests.items():
+            lines.append(f'opaca_requests_total{{kind="{kind}",name="{escape(name)}",status="{status}"}} {count}')
+
+        lines += [
+            '# HELP opaca_request_duration_seconds Duration of invocations by kind and name.',
+            '# TYPE opaca_request_duration_seconds histogram',
+        ]
+        for (kind, name), histogram in self.histograms.items():
+            labels = f'kind="{kind}",name="{escape(name)}"'
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), histogram):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'opaca_request_duration_seconds_bucket{{{labels},le="{le}"}} {cumulative}')
+            lines.append(f'opaca_request_duration_seconds_sum{{{labels}}} {histogram[-1]}')
+            lines.append(f'opaca_request_duration_seconds_count{{{labels}}} {cumulative}')
+
+        lines += [
+            '# HELP opaca_requests_in_flight Number of invocations currently running by kind and name.',
+            '# TYPE opaca_requests_in_flight gauge',
+        ]
+        for (kind, name), count in self.in_flight.items():
+            lines.append(f'opaca_requests_in_flight{{kind="{kind}",name="{escape(name)}"}} {count}')
+
+        lines += [
+            '# HELP opaca_stream_bytes_total Number of bytes sent by stream.',
+            '# TYPE opaca_stream_bytes_total counter',
+        ]
+        for name, count in self.bytes_streamed.items():
+            lines.append(f'opaca_stream_bytes_total{{name="{escape(name)}"}} {count}')
+
+        lines += [
+            '# HELP opaca_broadcasts_total Number of messages broadcast by subscribed channel, "other" for all other channels.',
+            '# TYPE opaca_broadcasts_total counter',
+        ]
+        for channel, count in self.broadcasts.items():
+            lines.append(f'opaca_broadcasts_total{{channel="{escape(channel)}"}} {count}')
+
+        lines += [
+            '# HELP opaca_messages_total Number of messages sent by receiving agent.',
+            '# TYPE opaca_messages_total counter',
+        ]
+        for agent_id, count in self.messages.items():
+            lines.append(f'opaca_messages_total{{agent="{escape(agent_id)}"}} {count}')
+
+        return '\n'.join(lines) + '\n'
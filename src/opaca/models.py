@@ -1,6 +1,7 @@
 from pydantic import BaseModel, Field
 from typing import Dict, List, Any, Optional
 from enum import Enum
+from datetime import datetime
 
 
 class Message(BaseModel):
@@ -24,6 +25,9 @@ class Parameter(BaseModel):
     type: str
     required: bool = True
     items: Optional[ArrayItems] = None
+    # element type and shape of NumPy array parameters, with None for dimensions of any size
+    dtype: Optional[str] = Field(default=None, exclude_if=lambda value: value is None)
+    shape: Optional[List[Optional[int]]] = Field(default=None, exclude_if=lambda value: value is None)
 
 
 class ActionDescription(BaseModel):
@@ -32,6 +36,10 @@ class ActionDescription(BaseModel):
     parameters: Dict[str, Parameter]
     result: Parameter
     callback: Any = Field(exclude=True)
+    validator: Any = Field(default=None, exclude=True)
+    cache: Any = Field(default=None, exclude=True)
+    single_flight: Any = Field(default=None, exclude=True)
+    limiter: Any = Field(default=None, exclude=True)
 
 
 class StreamDescription(BaseModel):
@@ -44,6 +52,9 @@ class StreamDescription(BaseModel):
     description: str = ''
     mode: Mode = Mode.GET
     callback: Any = Field(exclude=True)
+    media_type: str = Field(default='application/octet-stream', exclude=True)
+    chunk_size: int = Field(default=64 * 1024, exclude=True)
+    flush_interval: float = Field(default=0.005, exclude=True)
 
 
 class ImageParameter(BaseModel):
@@ -92,6 +103,38 @@ class ContainerDescription(BaseModel):
     connectivity: None = None
 
 
+class BatchInvocation(BaseModel):
+    action: str
+    agentId: Optional[str] = None
+    parameters: Dict[str, Any] = {}
+
+
+class BatchResult(BaseModel):
+    index: int
+    result: Any = None
+    error: Optional[Dict[str, Any]] = None
+
+
+class TaskStatus(BaseModel):
+
+    class State(Enum):
+        RUNNING = 'running'
+        SUCCEEDED = 'succeeded'
+        FAILED = 'failed'
+        CANCELLED = 'cancelled'
+
+    taskId: str
+    action: str
+    agentId: Optional[str] = None
+    state: State = State.RUNNING
+    progress: Optional[float] = None
+    message: Optional[str] = None
+    result: Any = None
+    error: Optional[Dict[str, Any]] = None
+    createdAt: datetime
+    finishedAt: Optional[datetime] = None
+
+
 class Login(BaseModel):
     username: str
     password: str
@@ -0,0 +1,227 @@
+import gzip
+import zlib
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from pydantic_core import to_json, from_json, to_jsonable_python
+
+from .arrays import NPY_EXT_TYPE, CBOR_MULTI_DIM_TAG, CBOR_TYPED_ARRAY_TAGS, is_array, to_builtin, to_npy, from_npy, \
+    to_cbor, from_cbor
+from .utils import http_error
+
+
+JSON = 'application/json'
+MSGPACK = 'application/msgpack'
+CBOR = 'application/cbor'
+
+MEDIA_TYPE_ALIASES = {
+    'application/x-msgpack': MSGPACK,
+    'application/vnd.msgpack': MSGPACK,
+}
+
+# content codings in order of preference, if the client accepts several of them equally
+ENCODINGS = ('zstd', 'br', 'gzip')
+
+DEFAULT_COMPRESSION_THRESHOLD = 1024
+
+# maximum size of request bodies after decompressing them
+DEFAULT_MAX_BODY_SIZE = 64 * 1024 * 1024
+
+Codec = Tuple[Callable[[Any], bytes], Callable[[bytes], Any]]
+Compressor = Tuple[Callable[[bytes], bytes], Callable[[bytes, int], bytes]]
+
+
+@lru_cache(maxsize=None)
+def get_codec(media_type: str) -> Optional[Codec]:
+    """
+    Get functions for encoding and decoding the media type, or None if it is not supported or the package
+    required for it is not installed. MessagePack requires `msgpack`, CBOR requires `cbor2`. NumPy arrays are
+    sent as lists in JSON, in the .npy format as an extension type in MessagePack and as typed arrays in CBOR.
+    """
+    if media_type == JSON:
+        return (lambda value: to_json(value, fallback=to_builtin)), from_json
+    if media_type == MSGPACK:
+        try:
+            import msgpack
+        except ImportError:
+            return None
+
+        def default(value: Any) -> Any:
+            if is_array(value):
+                data = to_npy(value)
+                return msgpack.ExtType(NPY_EXT_TYPE, data) if data is not None else value.tolist()
+            return to_jsonable_python(value, fallback=to_builtin)
+
+        def ext_hook(code: int, data: bytes) -> Any:
+            return from_npy(data) if code == NPY_EXT_TYPE else msgpack.ExtType(code, data)
+
+        return (lambda value: msgpack.packb(value, default=default),
+                lambda data: msgpack.unpackb(data, ext_hook=ext_hook))
+    if media_type == CBOR:
+        try:
+            import cbor2
+        except ImportError:
+            return None
+
+        def default(encoder: Any, value: Any):
+            if is_array(value):
+                encoder.encode(to_cbor(value, cbor2.CBORTag))
+            else:
+                encoder.encode(to_jsonable_python(value, fallback=to_builtin))
+
+        def tag_hook(*args: Any) -> Any:
+            # called with the decoder and the tag before cbor2 6, and with the tag and a flag since
+            tag = next(arg for arg in args if isinstance(arg, cbor2.CBORTag))
+            if tag.tag == CBOR_MULTI_DIM_TAG or tag.tag in CBOR_TYPED_ARRAY_TAGS:
+                return from_cbor(tag.tag, tag.value)
+            return tag
+
+        return (lambda value: cbor2.dumps(value, default=default),
+                lambda data: cbor2.loads(data, tag_hook=tag_hook))
+    return None
+
+
+def decompress_frames(make_decompressor: Callable[[], Any], data: bytes, max_size: int) -> bytes:
+    """
+    Decompress all frames (or gzip members) of the data with decompressors like `zlib.decompressobj()`,
+    stopping as soon as the output exceeds max_size bytes.
+    """
+    result = b''
+    while data:
+        decompressor = make_decompressor()
+        result += decompressor.decompress(data, max_length=max_size + 1 - len(result))
+        if len(result) > max_size:
+            break
+        if not decompressor.eof:
+            raise ValueError('Compressed data ended before the end-of-stream marker was reached')
+        data = decompressor.unused_data
+    return result
+
+
+def decompress_brotli(data: bytes, max_size: int) -> bytes:
+    """
+    Decompress brotli data, stopping as soon as the output exceeds max_size bytes.
+    """
+    import brotli
+    decompressor = brotli.Decompressor()
+    result = decompressor.process(data, output_buffer_limit=max_size + 1)
+    if len(result) <= max_size and not decompressor.is_finished():
+        raise ValueError('Compressed data ended before the end-of-stream marker was reached')
+    return result
+
+
+@lru_cache(maxsize=None)
+def get_compressor(encoding: str) -> Optional[Compressor]:
+    """
+    Get functions for compressing and decompressing with the content coding, or None if it is not supported
+    or the package required for it is not installed. zstd requires `zstandard` (before Python 3.14),
+    br requires `brotli`. Data is decompressed incrementally, returning at most max_size + 1 bytes,
+    so that small bodies expanding to huge amounts of data are detected without decompressing them completely.
+    """
+    if encoding == 'gzip':
+        return ((lambda data: gzip.compress(data, compresslevel=5)),
+                lambda data, max_size: decompress_frames(lambda: zlib.decompressobj(16 + zlib.MAX_WBITS), data, max_size))
+    if encoding == 'zstd':
+        try:
+            from compression import zstd
+            return zstd.compress, lambda data, max_size: decompress_frames(zstd.ZstdDecompressor, data, max_size)
+        except ImportError:
+            pass
+        try:
+            import zstandard
+        except ImportError:
+            return None
+        # unlike decompress(), the stream reader also reads frames without the content size, e.g. from streaming compressors
+        return (lambda data: zstandard.ZstdCompressor().compress(data),
+                lambda data, max_size: zstandard.ZstdDecompressor().stream_reader(data, read_across_frames=True).read(max_size + 1))
+    if encoding == 'br':
+        try:
+            import brotli
+        except ImportError:
+            return None
+        return (lambda data: brotli.compress(data, quality=4)), decompress_brotli
+    return None
+
+
+def parse_header(value: str) -> List[Tuple[str, float]]:
+    """
+    Parse a header like Accept or Accept-Encoding into its values and their quality, in order of preference.
+    """
+    values = []
+    for part in value.split(','):
+        name, *params = part.strip().split(';')
+        quality = 1.0
+        for param in params:
+            key, _, q = param.strip().partition('=')
+            if key == 'q':
+                try:
+                    quality = float(q)
+                except ValueError:
+                    quality = 0.0
+        if name:
+            values.append((MEDIA_TYPE_ALIASES.get(name.strip().lower(), name.strip().lower()), quality))
+    return sorted(values, key=lambda value: -value[1])
+
+
+def negotiate_media_type(accept: Optional[str]) -> str:
+    """
+    Get the supported media type the client prefers for the response, defaulting to JSON.
+    """
+    for media_type, quality in parse_header(accept or ''):
+        if quality <= 0:
+            continue
+        if media_type in (JSON, 'application/*', '*/*'):
+            return JSON
+        if get_codec(media_type) is not None:
+            return media_type
+    return JSON
+
+
+def negotiate_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """
+    Get the supported content coding the client prefers for the response, if any.
+    """
+    accepted = dict(parse_header(accept_encoding or ''))
+    candidates = [encoding for encoding in ENCODINGS
+                  if accepted.get(encoding, accepted.get('*', 0)) > 0 and get_compressor(encoding) is not None]
+    return max(candidates, key=lambda encoding: accepted.get(encoding, accepted.get('*', 0)), default=None)
+
+
+def decode_body(body: bytes, content_type: Optional[str], content_encoding: Optional[str],
+                max_size: int = DEFAULT_MAX_BODY_SIZE) -> Any:
+    """
+    Decompress and decode the request body according to its Content-Encoding and Content-Type headers.
+    Compressed bodies expanding to more than max_size bytes are rejected with 413.
+    """
+    if content_encoding and content_encoding != 'identity':
+        compressor = get_compressor(content_encoding.strip().lower())
+        if compressor is None:
+            raise http_error(415, f'Unsupported content encoding: {content_encoding}.')
+        try:
+            body = compressor[1](body, max_size)
+        except Exception as e:
+            raise http_error(400, f'Failed to decompress the request body: {e}')
+        if len(body) > max_size:
+            raise http_error(413, f'The decompressed request body exceeds {max_size} bytes.')
+    media_type = (content_type or JSON).split(';')[0].strip().lower()
+    codec = get_codec(MEDIA_TYPE_ALIASES.get(media_type, media_type))
+    if codec is None:
+        raise http_error(415, f'Unsupported content type: {content_type}.')
+    try:
+        return codec[1](body)
+    except Exception as e:
+        raise http_error(400, f'Failed to decode the request body: {e}')
+
+
+def encode_payload(value: Any, media_type: str, encoding: Optional[str] = None,
+                   threshold: int = DEFAULT_COMPRESSION_THRESHOLD) -> Tuple[bytes, Dict[str, str]]:
+    """
+    Encode the value in the media type, compressing it with the content coding if it is at least threshold bytes.
+    Returns the body and the headers to send with it.
+    """
+    body = get_codec(media_type)[0](value)
+    headers = {'Content-Type': media_type, 'Vary': 'Accept, Accept-Encoding'}
+    if encoding is not None and len(body) >= threshold:
+        body = get_compressor(encoding)[0](body)
+        headers['Content-Encoding'] = encoding
+    return body, headers
@@ -0,0 +1,143 @@
+import asyncio
+import importlib.util
+import random
+from typing import Dict, Any, Optional, Tuple
+
+from .caching import CachePolicy, ResultCache
+from .limits import remaining_time
+from .utils import http_error
+
+
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')
+
+
+class PlatformClient:
+    """
+    Async client for calling actions of other agents via the OPACA Runtime Platform the container is running on.
+
+    All calls share one connection pool with keep-alive connections (using HTTP/2 if the `h2` package is
+    installed) and the container's platform token. Requests that could not connect to the platform or were
+    rejected with 429 are retried with exponential backoff and full jitter, as they were not processed. Other
+    failed requests and responses with one of the retry_statuses are only retried for idempotent methods, or
+    if explicitly requested with `retry=True`, e.g. for actions that may safely run twice. The remaining time of
+    the deadline of the current request, if any, is used as timeout and passed on to the platform.
+
+    Requires the `httpx` package, e.g. by installing `opaca[client]`.
+
+    :param base_url: URL of the platform, defaults to the container's PLATFORM_URL.
+    :param token: Token for authenticating with the platform, defaults to the container's TOKEN.
+    :param timeout: Default timeout for requests in seconds.
+    :param retries: How often failed requests are retried.
+    :param backoff: Base delay before the first retry in seconds, doubling with every further retry.
+    :param retry_statuses: Response status codes after which idempotent requests are retried.
+    :param cache: Optional policy for caching the results of invocations.
+    :param transport: Optional httpx transport, e.g. `httpx.ASGITransport(app)` to test against a local app.
+    """
+
+    def __init__(self, base_url: str, token: str = '', timeout: float = 30.0, retries: int = 3, backoff: float = 0.1,
+                 retry_statuses: Tuple[int, ...] = (429, 502, 503), cache: Optional[CachePolicy] = None,
+                 transport: Any = None):
+        self.base_url: str = base_url.rstrip('/')
+        self.token: str = token
+        self.timeout: float = timeout
+        self.retries: int = retries
+        self.backoff: float = backoff
+        self.retry_statuses: Tuple[int, ...] = retry_statuses
+        self.cache: Optional[ResultCache] = ResultCache(cache) if cache is not None else None
+        self.transport: Any = transport
+        self.client = None
+
+    def get_client(self):
+        """
+        Get the shared HTTP client, creating it on first use.
+        """
+        if self.client is None:
+            if not self.base_url:
+                raise ValueError('The platform URL is not set. The container gets it from the PLATFORM_URL environment '
+                                 'variable when started by the platform, otherwise pass it as base_url.')
+            try:
+                import httpx
+            except ImportError:
+                raise ImportError('The platform client requires the "httpx" package, install it with "pip install opaca[client]".')
+            headers = {'Authorization': f'Bearer {self.token}'} if self.token else {}
+            self.client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers=headers,
+                timeout=self.timeout,
+                http2=self.transport is None and importlib.util.find_spec('h2') is not None,
+                limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+                transport=self.transport,
+            )
+        return self.client
+
+    async def invoke(self, action: str, parameters: Optional[Dict[str, Any]] = None, agent_id: Optional[str] = None,
+                     container_id: Optional[str] = None, login_token: Optional[str] = None,
+                     timeout: Optional[float] = None, retry: bool = False) -> Any:
+        """
+        Invoke the action on the platform, optionally on a specific agent or in a specific container.
+        Set retry if the action is idempotent, so that it is also retried if the platform fails or is unavailable.
+        """
+        parameters = parameters or {}
+        if self.cache is None:
+            return await self.send_invoke(action, parameters, agent_id, container_id, login_token, timeout, retry)
+        key = {'action': action, 'parameters': parameters, 'agentId': agent_id, 'containerId': container_id,
+               'login_token': login_token}
+        return await self.cache.get_or_call(key, lambda: self.send_invoke(action, parameters, agent_id, container_id, login_token, timeout, retry))
+
+    async def send_invoke(self, action: str, parameters: Dict[str, Any], agent_id: Optional[str],
+                          container_id: Optional[str], login_token: Optional[str], timeout: Optional[float],
+                          retry: bool) -> Any:
+        path = f'/invoke/{action}' if agent_id is None else f'/invoke/{action}/{agent_id}'
+        params = {'containerId': container_id} if container_id else {}
+        headers = {'ContainerLoginToken': login_token} if login_token else {}
+        response = await self.request('POST', path, json=parameters, params=params, headers=headers, timeout=timeout, retry=retry)
+        return response.json()
+
+    async def request(self, method: str, path: str, timeout: Optional[float] = None, retry: Optional[bool] = None, **kwargs):
+        """
+        Send a request to the platform, retrying it if it could not connect or was rejected with 429, and also
+        if it failed or the platform is unavailable if retry is set, by default for idempotent methods only.
+        Raises an HTTPException with the platform's status code if the request ultimately fails, or with 502
+        if the platform could not be reached and 504 if it did not answer in time.
+        """
+        import httpx
+        client = self.get_client()
+        headers = kwargs.pop('headers', {})
+        if retry is None:
+            retry = method.upper() in IDEMPOTENT_METHODS
+        for attempt in range(self.retries + 1):
+            remaining = remaining_time(timeout or self.timeout)
+            if remaining <= 0:
+                raise http_error(504, f'Deadline passed before calling {path} on the platform.')
+            delay = random.uniform(0, self.backoff * 2 ** attempt)
+            try:
+                response = await client.request(method, path, timeout=remaining,
+                                                headers={**headers, 'RequestTimeout': f'{remaining:.3f}'}, **kwargs)
+            except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout) as e:
+                # the request was not sent yet, so it can always be retried
+                if attempt == self.retries:
+                    raise http_error(504 if isinstance(e, httpx.TimeoutException) else 502, f'Failed to connect to the platform: {e}')
+            except httpx.TransportError as e:
+                # the request may have been processed before the connection broke or timed out
+                if not retry or attempt == self.retries:
+                    if isinstance(e, httpx.TimeoutException):
+                        raise http_error(504, f'Calling {path} on the platform timed out.')
+                    raise http_error(502, f'Failed to call {path} on the platform: {e}')
+            else:
+                retryable = response.status_code == 429 or (retry and response.status_code in self.retry_statuses)
+                if not retryable or attempt == self.retries:
+                    if response.is_error:
+                        raise http_error(response.status_code, f'Calling {path} on the platform failed: {response.text}')
+                    return response
+                retry_after = response.headers.get('Retry-After', '')
+                if retry_after.isdigit():
+                    delay = max(delay, int(retry_after))
+            await asyncio.sleep(delay)
+
+    async def close(self):
+        """
+        Close all connections of the client. It will be re-created if used again.
+        """
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
@@ -0,0 +1,97 @@
+import asyncio
+import logging
+import math
+import time
+from typing import List, Optional, Set, TYPE_CHECKING
+
+from .abstract_agent import AbstractAgent
+
+if TYPE_CHECKING:
+    from .container import Container
+
+
+logger = logging.getLogger(__name__)
+
+
+class AgentPool:
+    """
+    Keeps a number of agents of a registered agent type in the container that grows and shrinks with their load,
+    i.e. the number of invocations they are running or that are waiting for a free slot. Every interval seconds,
+    agents are spawned until there are enough to handle the load with at most target_load invocations per agent.
+    If fewer agents would suffice for cooldown seconds, the least busy agent is retired.
+
+    Use the 'least-busy' dispatch policy of the container to spread invocations evenly over the agents.
+    The pool is started and stopped together with the app created by `create_routes`.
+
+    :param container: The container to spawn the agents in.
+    :param agent_type: The registered agent type, see `Container.register_agent_type`.
+    :param min_size: Minimum number of agents, spawned right away.
+    :param max_size: Maximum number of agents.
+    :param target_load: Number of running or waiting invocations per agent to aim for.
+    :param interval: Seconds between checks of the load.
+    :param cooldown: Seconds the load has to stay low before an agent is retired.
+    """
+
+    def __init__(self, container: 'Container', agent_type: str, min_size: int = 1, max_size: int = 8,
+                 target_load: float = 4, interval: float = 1.0, cooldown: float = 30.0):
+        if not 0 <= min_size <= max_size or max_size < 1:
+            raise ValueError('The pool size must satisfy 0 <= min_size <= max_size and max_size >= 1.')
+        self.container: 'Container' = container
+        self.agent_type: str = agent_type
+        self.min_size: int = min_size
+        self.max_size: int = max_size
+        self.target_load: float = target_load
+        self.interval: float = interval
+        self.cooldown: float = cooldown
+        self.agents: List[AbstractAgent] = [container.spawn_agent(agent_type) for _ in range(min_size)]
+        self.low_since: Optional[float] = None
+        self.retiring: Set[asyncio.Task] = set()
+        self.task: Optional[asyncio.Task] = None
+        container.pools.append(self)
+
+    def get_load(self) -> int:
+        return sum(agent.get_load() for agent in self.agents)
+
+    def scale(self):
+        """
+        Spawn or retire agents according to the current load.
+        """
+        # forget agents that were removed from the container in the meantime
+        self.agents = [agent for agent in self.agents if self.container.agents.get(agent.agent_id) is agent]
+        desired = min(max(math.ceil(self.get_load() / self.target_load), self.min_size), self.max_size)
+        if desired > len(self.agents):
+            self.low_since = None
+            self.agents += [self.container.spawn_agent(self.agent_type) for _ in range(desired - len(self.agents))]
+        elif desired < len(self.agents):
+            now = time.monotonic()
+            if self.low_since is None:
+                self.low_since = now
+            elif now - self.low_since >= self.cooldown:
+                self.low_since = now
+                agent = min(self.agents, key=lambda agent: agent.get_load())
+                self.agents.remove(agent)
+                task = asyncio.create_task(self.container.retire_agent(agent.agent_id))
+                self.retiring.add(task)
+                task.add_done_callback(self.retiring.discard)
+        else:
+            self.low_since = None
+
+    async def run(self):
+        """
+        Scale the pool periodically, until cancelled.
+        """
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                self.scale()
+            except Exception:
+                logger.exception('Failed to scale pool of %s agents', self.agent_type)
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
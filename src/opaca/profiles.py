@@ -0,0 +1,40 @@
+import importlib.util
+from typing import Dict, Any, Optional
+
+PROFILES = ('development', 'production')
+
+
+def check_profile(profile: str) -> str:
+    """
+    Raise an error if the given profile is not known, otherwise return it.
+    """
+    if profile not in PROFILES:
+        raise ValueError(f'Unknown profile "{profile}", must be one of {PROFILES}.')
+    return profile
+
+
+def get_server_options(profile: str, keep_alive: Optional[int] = None, backlog: Optional[int] = None,
+                       limit_concurrency: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Get the options for uvicorn for the given profile. The production profile uses uvloop and httptools
+    if they are installed, turns off the access log and keeps connections open longer by default.
+
+    :param keep_alive: Seconds to keep idle connections open.
+    :param backlog: Maximum number of connections waiting to be accepted.
+    :param limit_concurrency: Maximum number of concurrent connections and tasks, before responding with 503.
+    """
+    options: Dict[str, Any] = {}
+    if check_profile(profile) == 'production':
+        options.update(
+            loop='uvloop' if importlib.util.find_spec('uvloop') else 'asyncio',
+            http='httptools' if importlib.util.find_spec('httptools') else 'h11',
+            access_log=False,
+            timeout_keep_alive=30,
+        )
+    if keep_alive is not None:
+        options['timeout_keep_alive'] = keep_alive
+    if backlog is not None:
+        options['backlog'] = backlog
+    if limit_concurrency is not None:
+        options['limit_concurrency'] = limit_concurrency
+    return options
@@ -1,42 +1,188 @@
-from typing import List, Dict, Any, Annotated
-from fastapi import FastAPI
+import asyncio
+import inspect
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import List, Dict, Any, Annotated, Tuple, AsyncIterator
+from fastapi import FastAPI, Request, Query, Depends
 from fastapi.params import Header
-from starlette.responses import StreamingResponse
+from pydantic_core import to_json
+from starlette.responses import StreamingResponse, Response, PlainTextResponse
 
 from .container import Container
-from .models import Message, AgentDescription, ContainerDescription, StreamDescription, Login
+from .metrics import Metrics, get_status
+from .limits import request_deadline
+from .utils import http_error
+from .profiles import check_profile
+from .workers import WORKERS_ENV
+from .arrays import to_builtin, contains_array
+from .payloads import JSON, MSGPACK, CBOR, DEFAULT_COMPRESSION_THRESHOLD, DEFAULT_MAX_BODY_SIZE, decode_body, \
+    encode_payload, negotiate_media_type, negotiate_encoding
+from .streams import BodyStream, make_stream_response as make_response_from_stream, encode_partial_results
+from .models import Message, AgentDescription, ContainerDescription, StreamDescription, Login, BatchInvocation, \
+    BatchResult, TaskStatus
 
 
-def create_routes(title: str, container: Container) -> FastAPI:
+class JSONBytesResponse(Response):
+    """
+    JSON response serialized in a single pass by pydantic-core, also supporting pydantic models, dataclasses,
+    datetimes etc., without converting the content to plain Python objects with `jsonable_encoder` first.
+    """
+    media_type = 'application/json'
+
+    def render(self, content: Any) -> bytes:
+        return to_json(content, fallback=to_builtin)
+
+
+class PartialResultsResponse(StreamingResponse):
+    """
+    Streams the partial results of a streaming action as they are produced. The results are closed as soon as
+    the client disconnects, also while the action is still working on its next result, and in any case once
+    the response is done, so that the action stops and frees its concurrency slot.
+    """
+
+    def __init__(self, results: AsyncIterator[Any], media_type: str):
+        super().__init__(encode_partial_results(results, media_type), media_type=media_type)
+        self.results: AsyncIterator[Any] = results
+
+    async def __call__(self, scope, receive, send):
+        stream = asyncio.ensure_future(self.stream_response(send))
+
+        async def watch_disconnect():
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+            stream.cancel()
+
+        watcher = asyncio.ensure_future(watch_disconnect())
+        try:
+            await stream
+        except asyncio.CancelledError:
+            if not watcher.done():
+                raise
+        except OSError:
+            # the client disconnected while the next results were sent
+            pass
+        finally:
+            watcher.cancel()
+            if not stream.done():
+                stream.cancel()
+                await asyncio.wait([stream])
+            await self.results.aclose()
+
+
+INVOKE_OPENAPI = {
+    'requestBody': {
+        'required': True,
+        'content': {media_type: {'schema': {'type': 'object', 'additionalProperties': True}}
+                    for media_type in (JSON, MSGPACK, CBOR)},
+    },
+}
+
+
+def create_routes(title: str, container: Container, metrics: bool = False, profile: str = 'development',
+                  compression_threshold: int = DEFAULT_COMPRESSION_THRESHOLD, max_body_size: int = DEFAULT_MAX_BODY_SIZE,
+                  manage_agents: bool = False) -> FastAPI:
     """
     Create FastAPI instance providing the different REST routes for the OPACA API and 
     calling the respective methods of the given container instance. The application
-    still has to be run with `uvicorn.run(app, ...)`.
+    still has to be run with `uvicorn.run(app, ...)`. If metrics is set, an additional
+    `/metrics` route provides request metrics in the Prometheus text format. The production profile turns
+    off debug mode and serializes action results directly to JSON. Results of invocations are sent as
+    MessagePack or CBOR if the client accepts them, and compressed if at least compression_threshold bytes.
+    Compressed parameters expanding to more than max_body_size bytes are rejected with 413. If manage_agents
+    is set, agents of registered types can be spawned via `POST /spawn/{agentType}` and retired again via
+    `DELETE /agents/{agentId}`; these routes are not protected, so only enable them if the container is not exposed.
     """
-    app = FastAPI(debug=True, title=title)
+    if manage_agents and WORKERS_ENV in os.environ:
+        raise ValueError('Spawning and retiring agents via routes is not supported with several workers, '
+                         'since each worker has its own agents.')
+
+    @asynccontextmanager
+    async def lifespan(_app: FastAPI):
+        cleanup = asyncio.create_task(container.sessions.run_cleanup())
+        task_cleanup = asyncio.create_task(container.tasks.run_cleanup())
+        for pool in container.pools:
+            pool.start()
+        for agent in container.agents.values():
+            agent.inbox.start()
+        yield
+        cleanup.cancel()
+        task_cleanup.cancel()
+        for pool in container.pools:
+            pool.stop()
+        container.tasks.close()
+        for agent in container.agents.values():
+            agent.inbox.close()
+        await container.platform.close()
+        await container.sessions.store.close()
+        container.executors.shutdown(wait=False)
+
+    production = check_profile(profile) == 'production'
+    app = FastAPI(debug=not production, title=title, lifespan=lifespan)
+    collector = Metrics() if metrics else None
+
+    async def read_parameters(request: Request) -> Dict[str, Any]:
+        """
+        Read the parameters of an invocation from the request body, encoded as JSON, MessagePack or CBOR
+        and optionally compressed, according to the Content-Type and Content-Encoding headers.
+        """
+        body = await request.body()
+        if not body:
+            return {}
+        parameters = decode_body(body, request.headers.get('content-type'), request.headers.get('content-encoding'), max_body_size)
+        if not isinstance(parameters, dict):
+            raise http_error(422, 'The parameters must be an object.')
+        return parameters
+
+    if collector is not None:
+        @app.get('/metrics', response_class=PlainTextResponse)
+        async def get_metrics():
+            """
+            Get metrics of the container in the Prometheus text format.
+            """
+            return PlainTextResponse(collector.render(), media_type='text/plain; version=0.0.4')
 
     @app.get('/info', response_model=ContainerDescription)
-    async def get_container_info() -> ContainerDescription:
+    async def get_container_info(request: Request) -> Response:
         """
         Get a description of the container.
         """
-        return container.get_description()
+        return make_cached_response(request, container.get_description_json())
 
 
     @app.get('/agents', response_model=List[AgentDescription])
-    async def get_all_agents() -> List[AgentDescription]:
+    async def get_all_agents(request: Request) -> Response:
         """
         Get a list of all agents and their corresponding actions.
         """
-        return container.get_agent_descriptions()
+        return make_cached_response(request, container.get_agent_descriptions_json())
 
 
     @app.get('/agents/{agentId}', response_model=AgentDescription)
-    async def get_agent(agentId: str) -> AgentDescription:
+    async def get_agent(agentId: str, request: Request) -> Response:
         """
         Returns the agent with the passed agentId.
         """
-        return container.get_agent(agentId).make_description()
+        return make_cached_response(request, container.get_agent_description_json(agentId))
+
+
+    if manage_agents:
+        @app.post('/spawn/{agentType}', response_model=AgentDescription)
+        async def spawn_agent(agentType: str, agentId: str = '') -> AgentDescription:
+            """
+            Spawn a new agent of a registered agent type, optionally with the given agentId.
+            """
+            return container.spawn_agent(agentType, agentId).make_description()
+
+        @app.delete('/agents/{agentId}')
+        async def retire_agent(agentId: str, timeout: Annotated[float | None, Query(ge=0)] = 30.0) -> bool:
+            """
+            Retire an agent spawned at runtime: it stops receiving requests and messages right away and is removed
+            once it has finished its running invocations, or after the timeout. Returns whether it finished in time.
+            """
+            if container.has_agent(agentId) and agentId not in container.spawned_agents:
+                raise http_error(403, f'Agent {agentId} was not spawned at runtime and cannot be retired.')
+            return await container.retire_agent(agentId, timeout)
 
 
     @app.post('/send/{agentId}')
@@ -45,30 +191,113 @@ def create_routes(title: str, container: Container) -> FastAPI:
         Send a message to the specified agent.
         """
         container.send_message(agentId, message)
+        if collector is not None:
+            collector.count_message(agentId)
 
 
-    @app.post('/broadcast/{channel}')
+    @app.post('/broadcast/{channel:path}')
     async def broadcast(channel: str, message: Message):
         """
         Broadcast a message to all agents that listen on the channel.
         """
         container.broadcast(channel, message)
+        if collector is not None:
+            # only channels agents subscribed to are labelled by name, as the path may be any string
+            collector.count_broadcast(channel if channel in container.channels else 'other')
 
 
-    @app.post('/invoke/{action}', response_model=Any)
-    async def invoke_action(action: str, parameters: Dict[str, Any], ContainerLoginToken: Annotated[str | None, Header()] = None):
+    @app.post('/invoke/{action}', response_model=Any, openapi_extra=INVOKE_OPENAPI)
+    async def invoke_action(action: str, parameters: Annotated[Dict[str, Any], Depends(read_parameters)], request: Request, response: Response,
+                            ContainerLoginToken: Annotated[str | None, Header()] = None,
+                            RequestTimeout: Annotated[float | None, Header(gt=0)] = None):
         """
         Invoke the specified action on any agent that knows the action.
+        Streaming actions send their partial results as they are produced if requested by the Accept header.
+        Background actions, or any action if requested with `Prefer: respond-async`, return a task right away.
         """
-        return await container.invoke_action(action, parameters, ContainerLoginToken.strip('"') if ContainerLoginToken else None)
+        if (media_type := get_streaming_media_type(request, action)) is not None:
+            return await make_partial_results_response(request, action, parameters, media_type, RequestTimeout, await get_login_token(ContainerLoginToken))
+        if runs_in_background(request, action):
+            login_token = await get_login_token(ContainerLoginToken)
+            return submit_task(request, action, lambda: measure('action', action, container.invoke_action(action, parameters, login_token)),
+                               login_token, RequestTimeout)
+        # the agent is selected here, so that the cache headers are those of the agent actually invoked
+        agent = container.dispatch_action(action)
+        result = await run_request(request, RequestTimeout, measure('action', action, agent.invoke_action(action, parameters, await get_login_token(ContainerLoginToken))))
+        return make_result_response(result, request, response, action, agent.agent_id)
 
 
-    @app.post('/invoke/{action}/{agentId}', response_model=Any)
-    async def invoke_agent_action(action: str, agentId: str, parameters: Dict[str, Any], ContainerLoginToken: Annotated[str | None, Header()] = None):
+    @app.post('/invoke/{action}/{agentId}', response_model=Any, openapi_extra=INVOKE_OPENAPI)
+    async def invoke_agent_action(action: str, agentId: str, parameters: Annotated[Dict[str, Any], Depends(read_parameters)], request: Request, response: Response,
+                                  ContainerLoginToken: Annotated[str | None, Header()] = None,
+                                  RequestTimeout: Annotated[float | None, Header(gt=0)] = None):
         """
         Invoke an action on a specific agent.
+        Streaming actions send their partial results as they are produced if requested by the Accept header.
+        Background actions, or any action if requested with `Prefer: respond-async`, return a task right away.
         """
-        return await container.invoke_agent_action(action, agentId, parameters, ContainerLoginToken.strip('"') if ContainerLoginToken else None)
+        if (media_type := get_streaming_media_type(request, action, agentId)) is not None:
+            return await make_partial_results_response(request, action, parameters, media_type, RequestTimeout, await get_login_token(ContainerLoginToken), agentId)
+        if runs_in_background(request, action, agentId):
+            login_token = await get_login_token(ContainerLoginToken)
+            return submit_task(request, action, lambda: measure('action', action, container.invoke_agent_action(action, agentId, parameters, login_token)),
+                               login_token, RequestTimeout, agentId)
+        result = await run_request(request, RequestTimeout, measure('action', action, container.invoke_agent_action(action, agentId, parameters, await get_login_token(ContainerLoginToken))))
+        return make_result_response(result, request, response, action, agentId)
+
+
+    @app.post('/invoke-batch', response_model=List[BatchResult])
+    async def invoke_batch(invocations: List[BatchInvocation], request: Request, stream: bool = False,
+                           concurrency: Annotated[int | None, Query(gt=0)] = None,
+                           ContainerLoginToken: Annotated[str | None, Header()] = None,
+                           RequestTimeout: Annotated[float | None, Header(gt=0)] = None):
+        """
+        Invoke several actions concurrently and get their results and errors in input order.
+        If stream is set, each result is sent as a line of NDJSON as soon as it is available.
+        """
+        login_token = await get_login_token(ContainerLoginToken)
+        if stream:
+            results = container.invoke_batch_iter(invocations, login_token, concurrency)
+            return StreamingResponse((to_json(result, fallback=to_builtin) + b'\n' async for result in results), media_type='application/x-ndjson')
+        results = await run_request(request, RequestTimeout, measure('batch', 'invoke-batch', container.invoke_batch(invocations, login_token, concurrency)))
+        return JSONBytesResponse(results)
+
+
+    @app.get('/tasks/{taskId}', response_model=TaskStatus)
+    async def get_task(taskId: str, request: Request, ContainerLoginToken: Annotated[str | None, Header()] = None):
+        """
+        Get the state, progress and, once finished, the result or error of a background task.
+        """
+        task = container.tasks.get(taskId, await get_login_token(ContainerLoginToken))
+        if task is None:
+            raise http_error(404, f'Task {taskId} not found.')
+        return make_task_response(task.status, request)
+
+
+    @app.delete('/tasks/{taskId}')
+    async def cancel_task(taskId: str, ContainerLoginToken: Annotated[str | None, Header()] = None) -> bool:
+        """
+        Cancel a running background task, or discard the result of a finished one.
+        """
+        if not container.tasks.cancel(taskId, await get_login_token(ContainerLoginToken)):
+            raise http_error(404, f'Task {taskId} not found.')
+        return True
+
+
+    @app.get('/stats')
+    async def get_action_stats() -> Dict[str, Dict[str, Dict[str, int]]]:
+        """
+        Get runtime statistics of the agents' actions, e.g. cache hits, coalesced invocations or queue depths.
+        """
+        return container.get_action_stats()
+
+
+    @app.delete('/cache/{action}')
+    async def purge_cache(action: str) -> int:
+        """
+        Remove all cached results of the specified action, returning the number of removed results.
+        """
+        return container.purge_cache(action)
 
 
     @app.get('/stream/{stream}', response_class=StreamingResponse)
@@ -76,15 +305,30 @@ def create_routes(title: str, container: Container) -> FastAPI:
         """
         GET a stream from any agent.
         """
-        return make_stream_response(stream, StreamDescription.Mode.GET, login_token=ContainerLoginToken.strip('"') if ContainerLoginToken else None)
+        return await measure_stream('stream', stream, make_stream_response(stream, StreamDescription.Mode.GET, login_token=await get_login_token(ContainerLoginToken)))
 
 
     @app.get('/stream/{stream}/{agentId}', response_class=StreamingResponse)
-    async def get_agent_stream(stream: str, agent_id: str, ContainerLoginToken: Annotated[str | None, Header()] = None):
+    async def get_agent_stream(stream: str, agentId: str, ContainerLoginToken: Annotated[str | None, Header()] = None):
         """
         GET a stream from the specified agent.
         """
-        return make_stream_response(stream, StreamDescription.Mode.GET, agent_id, ContainerLoginToken.strip('"') if ContainerLoginToken else None)
+        return await measure_stream('stream', stream, make_stream_response(stream, StreamDescription.Mode.GET, agentId, await get_login_token(ContainerLoginToken)))
+
+    @app.post('/stream/{stream}', response_model=Any)
+    async def post_stream(stream: str, request: Request, ContainerLoginToken: Annotated[str | None, Header()] = None):
+        """
+        POST a stream to any agent.
+        """
+        return await measure('stream', stream, invoke_post_stream(stream, request, login_token=await get_login_token(ContainerLoginToken)))
+
+
+    @app.post('/stream/{stream}/{agentId}', response_model=Any)
+    async def post_agent_stream(stream: str, agentId: str, request: Request, ContainerLoginToken: Annotated[str | None, Header()] = None):
+        """
+        POST a stream to the specified agent.
+        """
+        return await measure('stream', stream, invoke_post_stream(stream, request, agentId, await get_login_token(ContainerLoginToken)))
 
     @app.post('/login')
     async def handle_login(login: Login):
@@ -101,12 +345,190 @@ def create_routes(title: str, container: Container) -> FastAPI:
         return await container.handle_logout(ContainerLoginToken.strip('"') if ContainerLoginToken else None)
 
 
-    def make_stream_response(name: str, mode: StreamDescription.Mode, agent_id: str = None, login_token: str = None) -> StreamingResponse:
+    async def get_login_token(header: str | None) -> str | None:
+        """
+        Get the login token from the ContainerLoginToken header, if it belongs to a valid session.
+        """
+        return await container.sessions.resolve(header.strip('"') if header else None)
+
+
+    async def run_request(request: Request, timeout: float | None, awaitable):
+        """
+        Await the invocation in a separate task that is cancelled as soon as the client disconnects.
+        The optional timeout sets the deadline for the invocation, which is also propagated to nested calls.
+        """
+        token = request_deadline.set(time.monotonic() + timeout) if timeout is not None else None
+        task = asyncio.ensure_future(awaitable)
+        if token is not None:
+            request_deadline.reset(token)
+
+        async def watch_disconnect():
+            while (await request.receive())['type'] != 'http.disconnect':
+                pass
+            task.cancel()
+
+        watcher = asyncio.ensure_future(watch_disconnect())
+        try:
+            return await task
+        except asyncio.CancelledError:
+            if watcher.done():
+                raise http_error(499, 'Client closed the request.')
+            raise
+        finally:
+            watcher.cancel()
+            task.cancel()
+
+    def get_metric_name(kind: str, name: str) -> str:
+        """
+        Get the name to label the metrics of an action or stream with. Unknown names, which come straight
+        from the request path, are all labelled "unknown", so that they do not create new time series.
+        """
+        if kind == 'action' and container.get_action(name) is None:
+            return 'unknown'
+        if kind == 'stream' and container.get_stream(name) is None:
+            return 'unknown'
+        return name
+
+    async def measure(kind: str, name: str, awaitable):
+        """
+        Await the invocation, recording it in the metrics if enabled.
+        """
+        if collector is None:
+            return await awaitable
+        return await collector.measure(kind, get_metric_name(kind, name), awaitable)
+
+    async def measure_stream(kind: str, name: str, awaitable):
+        """
+        Await the start of the stream or streaming action, recording it in the metrics if enabled.
+        The latency covers the whole stream, until its results are exhausted.
+        """
+        if collector is None:
+            return await awaitable
+        name = get_metric_name(kind, name)
+        started_at = collector.start(kind, name)
+        try:
+            result = await awaitable
+        except BaseException as e:
+            collector.finish(kind, name, get_status(e), started_at)
+            raise
+        if isinstance(result, StreamingResponse):
+            result.body_iterator = collector.measure_iter(kind, name, result.body_iterator, started_at)
+        elif hasattr(result, '__aiter__'):
+            result = collector.measure_iter(kind, name, result, started_at)
+        else:
+            collector.finish(kind, name, result.status_code if isinstance(result, Response) else 200, started_at)
+        return result
+
+    def get_streaming_media_type(request: Request, name: str, agent_id: str = None) -> str | None:
+        """
+        Get the media type in which to stream the partial results of the action, if it is a streaming action
+        and the client accepts server-sent events or newline-delimited JSON.
+        """
+        accept = request.headers.get('accept', '')
+        if 'text/event-stream' not in accept and 'application/x-ndjson' not in accept:
+            return None
+        action = container.get_action(name, agent_id)
+        if action is None or not getattr(action.callback, '_streaming', False):
+            return None
+        return 'text/event-stream' if 'text/event-stream' in accept else 'application/x-ndjson'
+
+    async def make_partial_results_response(request: Request, name: str, parameters: Dict[str, Any], media_type: str,
+                                            timeout: float | None, login_token: str = None, agent_id: str = None) -> StreamingResponse:
+        """
+        Stream the partial results of the streaming action as they are produced. The optional timeout sets
+        the deadline for the whole stream, which is also limited by the timeout of the action.
+        """
+        results = await run_request(request, timeout, measure_stream('action', name, container.invoke_action_stream(name, parameters, login_token, agent_id)))
+        return PartialResultsResponse(results, media_type)
+
+    def set_cache_headers(response: Response, name: str, agent_id: str = None):
+        """
+        Tell clients how long they may cache the results of actions with a cache policy.
+        """
+        action = container.get_action(name, agent_id)
+        if action is not None and action.cache is not None and action.cache.policy.ttl is not None:
+            visibility = 'private' if getattr(action.callback, '_auth', False) else 'public'
+            response.headers['Cache-Control'] = f'{visibility}, max-age={int(action.cache.policy.ttl)}'
+
+    def make_result_response(result: Any, request: Request, response: Response, name: str, agent_id: str = None) -> Any:
+        """
+        Return the result of the action with its cache headers, in the media type and content coding negotiated
+        with the client. In the development profile, JSON results are returned to FastAPI as before, so they are
+        validated against the response model and not compressed. Otherwise, e.g. in the production profile or if
+        the client accepts a compact format, the result is serialized directly and compressed if accepted.
+        """
+        media_type = negotiate_media_type(request.headers.get('accept'))
+        if media_type == JSON and not production and not contains_array(result):
+            response.headers['Vary'] = 'Accept, Accept-Encoding'
+            set_cache_headers(response, name, agent_id)
+            return result
+        encoding = negotiate_encoding(request.headers.get('accept-encoding'))
+        body, headers = encode_payload(result, media_type, encoding, compression_threshold)
+        response = Response(body, headers=headers)
+        set_cache_headers(response, name, agent_id)
+        return response
+
+    def runs_in_background(request: Request, name: str, agent_id: str = None) -> bool:
+        """
+        Whether to run the invocation as a background task, if the client prefers an asynchronous response
+        or the action was declared with "background".
+        """
+        action = container.get_action(name, agent_id)
+        if action is None:
+            return False
+        return 'respond-async' in request.headers.get('prefer', '') or getattr(action.callback, '_background', False)
+
+    def submit_task(request: Request, name: str, invoke, login_token: str | None, timeout: float | None,
+                    agent_id: str = None) -> Response:
+        """
+        Start the invocation in the background and respond with 202 and the initial status of the task.
+        """
+        status = container.tasks.submit(name, invoke, login_token, agent_id, timeout)
+        headers = {'Location': f'/tasks/{status.taskId}', 'Retry-After': '1'}
+        if 'respond-async' in request.headers.get('prefer', ''):
+            headers['Preference-Applied'] = 'respond-async'
+        return make_task_response(status, request, 202, headers)
+
+    def make_task_response(status: TaskStatus, request: Request, status_code: int = 200, headers: Dict[str, str] = None) -> Response:
+        """
+        Send the status of a background task in the media type and content coding negotiated with the client.
+        """
+        media_type = negotiate_media_type(request.headers.get('accept'))
+        encoding = negotiate_encoding(request.headers.get('accept-encoding'))
+        body, payload_headers = encode_payload(status, media_type, encoding, compression_threshold)
+        return Response(body, status_code=status_code, headers={**payload_headers, **(headers or {})})
+
+    def make_cached_response(request: Request, cached: Tuple[bytes, str]) -> Response:
+        """
+        Send the pre-serialized description, or an empty 304 response if the client already has it.
+        """
+        body, etag = cached
+        if_none_match = request.headers.get('if-none-match')
+        if if_none_match and (if_none_match.strip() == '*' or etag in (tag.strip().removeprefix('W/') for tag in if_none_match.split(','))):
+            return Response(status_code=304, headers={'ETag': etag})
+        return Response(body, media_type='application/json', headers={'ETag': etag})
+
+    async def invoke_post_stream(name: str, request: Request, agent_id: str = None, login_token: str = None) -> Any:
+        """
+        Hand the request body as a stream of chunks to the stream invocation and return its result.
+        """
+        body = BodyStream(request.stream())
+        mode = StreamDescription.Mode.POST
+        result = container.invoke_stream(name, mode, login_token, body) if agent_id is None \
+            else container.invoke_agent_stream(name, mode, agent_id, login_token, body)
+        return await result if inspect.isawaitable(result) else result
+
+    async def make_stream_response(name: str, mode: StreamDescription.Mode, agent_id: str = None, login_token: str = None) -> Response:
         """
         Converts the byte stream from the stream invocation into the correct response format.
         """
         result = container.invoke_stream(name, mode, login_token) if agent_id is None \
             else container.invoke_agent_stream(name, mode, agent_id, login_token)
-        return StreamingResponse(result, media_type='application/octet-stream')
+        if inspect.isawaitable(result):
+            result = await result
+        stream = container.get_stream(name, agent_id)
+        count = (lambda size: collector.count_stream(name, size)) if collector is not None else None
+        return await make_response_from_stream(result, stream.media_type, stream.chunk_size, stream.flush_interval, count,
+                                               container.executors.get_thread_executor())
 
     return app
@@ -0,0 +1,308 @@
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import List, Optional, Callable, Awaitable, Any
+
+
+logger = logging.getLogger(__name__)
+
+
+class Session:
+    """
+    A login session, identified by the token generated by the container at login.
+    Times are wall-clock timestamps, so that sessions can be persisted and shared across processes.
+    """
+
+    __slots__ = ('token', 'created_at', 'last_used')
+
+    def __init__(self, token: str, created_at: float, last_used: float):
+        self.token: str = token
+        self.created_at: float = created_at
+        self.last_used: float = last_used
+
+
+class SessionStore(ABC):
+    """
+    Base class for backends storing the login sessions of a container.
+    """
+
+    @abstractmethod
+    async def get(self, token: str) -> Optional[Session]:
+        pass
+
+    @abstractmethod
+    async def put(self, session: Session) -> None:
+        pass
+
+    @abstractmethod
+    async def delete(self, token: str) -> bool:
+        """
+        Delete the session, returning whether it existed.
+        """
+
+    @abstractmethod
+    async def count(self) -> int:
+        pass
+
+    @abstractmethod
+    async def least_recently_used(self, n: int) -> List[str]:
+        """
+        Get the tokens of the n sessions not used for the longest time.
+        """
+
+    @abstractmethod
+    async def expired(self, created_before: float, used_before: float) -> List[str]:
+        """
+        Get the tokens of all sessions created before created_before or last used before used_before.
+        """
+
+    async def close(self) -> None:
+        pass
+
+
+class MemorySessionStore(SessionStore):
+    """
+    Keeps the sessions in memory, ordered by their last use. Sessions are lost when the container restarts.
+    """
+
+    def __init__(self):
+        self.sessions: OrderedDict[str, Session] = OrderedDict()
+
+    async def get(self, token: str) -> Optional[Session]:
+        return self.sessions.get(token)
+
+    async def put(self, session: Session) -> None:
+        self.sessions[session.token] = session
+        self.sessions.move_to_end(session.token)
+
+    async def delete(self, token: str) -> bool:
+        return self.sessions.pop(token, None) is not None
+
+    async def count(self) -> int:
+        return len(self.sessions)
+
+    async def least_recently_used(self, n: int) -> List[str]:
+        return [token for token, _ in zip(self.sessions, range(n))]
+
+    async def expired(self, created_before: float, used_before: float) -> List[str]:
+        return [token for token, session in self.sessions.items()
+                if session.created_at < created_before or session.last_used < used_before]
+
+
+class SqliteSessionStore(SessionStore):
+    """
+    Keeps the sessions in an SQLite database file, so that they survive restarts and can be shared
+    by several worker processes on the same host. Queries run in a worker thread, one at a time, so that
+    waiting for the database, e.g. while another process writes to it, does not block the event loop.
+    """
+
+    def __init__(self, path: str):
+        self.connection: sqlite3.Connection = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS sessions '
+                                '(token TEXT PRIMARY KEY, created_at REAL NOT NULL, last_used REAL NOT NULL)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS sessions_last_used ON sessions (last_used)')
+        self.lock: threading.Lock = threading.Lock()
+
+    async def run(self, func: Callable[[], Any]) -> Any:
+        """
+        Run the database operation in a worker thread, holding the lock of the shared connection.
+        """
+        def run_locked():
+            with self.lock:
+                return func()
+        return await asyncio.to_thread(run_locked)
+
+    async def get(self, token: str) -> Optional[Session]:
+        row = await self.run(lambda: self.connection.execute(
+            'SELECT token, created_at, last_used FROM sessions WHERE token = ?', (token,)).fetchone())
+        return Session(*row) if row is not None else None
+
+    async def put(self, session: Session) -> None:
+        await self.run(lambda: self.connection.execute('INSERT OR REPLACE INTO sessions VALUES (?, ?, ?)',
+                                                       (session.token, session.created_at, session.last_used)))
+
+    async def delete(self, token: str) -> bool:
+        return await self.run(lambda: self.connection.execute('DELETE FROM sessions WHERE token = ?', (token,)).rowcount) > 0
+
+    async def count(self) -> int:
+        return (await self.run(lambda: self.connection.execute('SELECT COUNT(*) FROM sessions').fetchone()))[0]
+
+    async def least_recently_used(self, n: int) -> List[str]:
+        rows = await self.run(lambda: self.connection.execute(
+            'SELECT token FROM sessions ORDER BY last_used LIMIT ?', (n,)).fetchall())
+        return [row[0] for row in rows]
+
+    async def expired(self, created_before: float, used_before: float) -> List[str]:
+        rows = await self.run(lambda: self.connection.execute(
+            'SELECT token FROM sessions WHERE created_at < ? OR last_used < ?', (created_before, used_before)).fetchall())
+        return [row[0] for row in rows]
+
+    async def close(self) -> None:
+        await self.run(self.connection.close)
+
+
+class RedisSessionStore(SessionStore):
+    """
+    Keeps the sessions in Redis or a Redis-compatible server, so that they can be shared across hosts.
+    The sessions are kept in two sorted sets, of all tokens by creation and by last use.
+
+    Requires the `redis` package, e.g. by installing `opaca[redis]`.
+
+    :param url: URL of the server, e.g. "redis://localhost:6379/0", used if no client is given.
+    :param client: Optional `redis.asyncio.Redis` client, or any client with the same interface.
+    :param prefix: Prefix of the keys used by this store.
+    """
+
+    def __init__(self, url: str = 'redis://localhost:6379/0', client: Any = None, prefix: str = 'opaca:sessions'):
+        if client is None:
+            try:
+                import redis.asyncio
+            except ImportError:
+                raise ImportError('The Redis session store requires the "redis" package, install it with "pip install opaca[redis]".')
+            client = redis.asyncio.from_url(url, decode_responses=True)
+        self.client = client
+        self.created_key: str = f'{prefix}:created'
+        self.used_key: str = f'{prefix}:used'
+
+    async def get(self, token: str) -> Optional[Session]:
+        pipeline = self.client.pipeline()
+        pipeline.zscore(self.created_key, token)
+        pipeline.zscore(self.used_key, token)
+        created_at, last_used = await pipeline.execute()
+        if created_at is None or last_used is None:
+            return None
+        return Session(token, created_at, last_used)
+
+    async def put(self, session: Session) -> None:
+        pipeline = self.client.pipeline()
+        pipeline.zadd(self.created_key, {session.token: session.created_at})
+        pipeline.zadd(self.used_key, {session.token: session.last_used})
+        await pipeline.execute()
+
+    async def delete(self, token: str) -> bool:
+        pipeline = self.client.pipeline()
+        pipeline.zrem(self.created_key, token)
+        pipeline.zrem(self.used_key, token)
+        removed, _ = await pipeline.execute()
+        return removed > 0
+
+    async def count(self) -> int:
+        return await self.client.zcard(self.created_key)
+
+    async def least_recently_used(self, n: int) -> List[str]:
+        return list(await self.client.zrange(self.used_key, 0, n - 1))
+
+    async def expired(self, created_before: float, used_before: float) -> List[str]:
+        pipeline = self.client.pipeline()
+        pipeline.zrangebyscore(self.created_key, '-inf', f'({created_before}')
+        pipeline.zrangebyscore(self.used_key, '-inf', f'({used_before}')
+        created, used = await pipeline.execute()
+        return list(dict.fromkeys([*created, *used]))
+
+    async def close(self) -> None:
+        await self.client.aclose()
+
+
+class SessionManager:
+    """
+    Keeps track of the login sessions of a container, expiring sessions after a maximum lifetime (ttl) or
+    after not being used for some time (idle_timeout), and evicting the least recently used sessions once
+    there are more than max_sessions. Whenever a session expires or is evicted, on_evict is called with its
+    token, which the container uses to log out of all agents.
+
+    :param store: Backend for storing the sessions, in memory by default.
+    :param ttl: Maximum lifetime of a session in seconds, or None for no limit.
+    :param idle_timeout: Seconds after which a session expires if it was not used, or None to keep unused sessions.
+    :param max_sessions: Maximum number of sessions, or None for no limit.
+    :param cleanup_interval: Seconds between checks for expired sessions.
+    """
+
+    TOUCH_INTERVAL = 1.0
+
+    def __init__(self, store: Optional[SessionStore] = None, ttl: Optional[float] = None,
+                 idle_timeout: Optional[float] = 3600.0, max_sessions: Optional[int] = 10000, cleanup_interval: float = 60.0):
+        self.store: SessionStore = store if store is not None else MemorySessionStore()
+        self.ttl: Optional[float] = ttl
+        self.idle_timeout: Optional[float] = idle_timeout
+        self.max_sessions: Optional[int] = max_sessions
+        self.cleanup_interval: float = cleanup_interval
+        self.on_evict: Optional[Callable[[str], Awaitable[Any]]] = None
+        self.evicted: int = 0
+
+    def is_expired(self, session: Session, now: float) -> bool:
+        return (self.ttl is not None and now - session.created_at > self.ttl) or \
+               (self.idle_timeout is not None and now - session.last_used > self.idle_timeout)
+
+    async def create(self, token: str):
+        """
+        Start a new session, evicting the least recently used sessions if there are too many.
+        """
+        now = time.time()
+        await self.store.put(Session(token, now, now))
+        if self.max_sessions is not None:
+            excess = await self.store.count() - self.max_sessions
+            if excess > 0:
+                for evicted in await self.store.least_recently_used(excess):
+                    await self.evict(evicted)
+
+    async def resolve(self, token: Optional[str]) -> Optional[str]:
+        """
+        Return the token if it belongs to a valid session, marking the session as used, or None otherwise.
+        """
+        if not token:
+            return None
+        session = await self.store.get(token)
+        if session is None:
+            return None
+        now = time.time()
+        if self.is_expired(session, now):
+            await self.evict(token)
+            return None
+        if now - session.last_used >= self.TOUCH_INTERVAL:
+            session.last_used = now
+            await self.store.put(session)
+        return token
+
+    async def remove(self, token: str) -> bool:
+        """
+        End the session without calling on_evict, e.g. when the user logged out.
+        """
+        return await self.store.delete(token)
+
+    async def evict(self, token: str):
+        if await self.store.delete(token):
+            self.evicted += 1
+            if self.on_evict is not None:
+                try:
+                    await self.on_evict(token)
+                except Exception:
+                    logger.exception('Failed to log out of evicted session')
+
+    async def expire(self):
+        """
+        Evict all sessions that have expired.
+        """
+        if self.ttl is None and self.idle_timeout is None:
+            return
+        now = time.time()
+        created_before = now - self.ttl if self.ttl is not None else float('-inf')
+        used_before = now - self.idle_timeout if self.idle_timeout is not None else float('-inf')
+        for token in await self.store.expired(created_before, used_before):
+            await self.evict(token)
+
+    async def run_cleanup(self):
+        """
+        Periodically evict expired sessions, until cancelled.
+        """
+        while True:
+            await asyncio.sleep(self.cleanup_interval)
+            try:
+                await self.expire()
+            except Exception:
+                logger.exception('Failed to expire sessions')
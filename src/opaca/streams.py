@@ -0,0 +1,306 @@
+import asyncio
+import logging
+import os
+import threading
+from collections import deque
+from concurrent.futures import Executor, Future
+from typing import AsyncIterator, Iterator, Any, Union, List, IO, Optional, Callable, TYPE_CHECKING
+
+from pydantic_core import to_json
+
+from .arrays import to_builtin
+from .executors import track_work
+
+if TYPE_CHECKING:
+    from starlette.responses import Response
+
+
+logger = logging.getLogger(__name__)
+
+
+class BodyStream:
+    """
+    Async iterator over the chunks of a request body, handed to the callbacks of POST streams.
+
+    The body is only read from the connection when the callback asks for the next chunk, and at most one
+    chunk received from the server is held at a time. If the callback consumes the body slower than it is
+    uploaded, the server stops reading from the socket, so arbitrarily large uploads are processed in constant
+    memory. Chunks are always `bytes`; chunks received from the server that are larger than `chunk_size` are split,
+    and only the parts handed to the callback are copied.
+    """
+
+    def __init__(self, source: AsyncIterator[bytes], chunk_size: int = 64 * 1024):
+        self.source: AsyncIterator[bytes] = source.__aiter__()
+        self.chunk_size: int = chunk_size
+        self.pending: memoryview = memoryview(b'')
+        self.bytes_received: int = 0
+
+    def __aiter__(self) -> 'BodyStream':
+        return self
+
+    async def __anext__(self) -> bytes:
+        if not self.pending:
+            chunk = b''
+            while not chunk:
+                chunk = await self.source.__anext__()
+                self.bytes_received += len(chunk)
+            if len(chunk) <= self.chunk_size:
+                return bytes(chunk)
+            self.pending = memoryview(chunk)
+        chunk, self.pending = self.pending[:self.chunk_size], self.pending[self.chunk_size:]
+        return bytes(chunk)
+
+    async def read_all(self) -> bytes:
+        """
+        Read the entire (remaining) body into memory. Only use this for small bodies.
+        """
+        return b''.join([chunk async for chunk in self])
+
+
+class ClosingIterator:
+    """
+    Async iterator over the items of another one, calling on_close exactly once when it is exhausted, fails or
+    is closed, with the error it failed with or GeneratorExit if it was closed early. Unlike async generators,
+    it also calls on_close and closes the wrapped iterator when it is closed without having been iterated.
+    """
+
+    def __init__(self, source: AsyncIterator[Any], on_close: Optional[Callable[[Optional[BaseException]], Any]] = None):
+        self.source: AsyncIterator[Any] = source
+        self.on_close: Optional[Callable[[Optional[BaseException]], Any]] = on_close
+        self.closed: bool = False
+
+    def __aiter__(self) -> 'ClosingIterator':
+        return self
+
+    async def __anext__(self) -> Any:
+        if self.closed:
+            raise StopAsyncIteration
+        try:
+            return await self.next_item()
+        except StopAsyncIteration:
+            await self.close(None)
+            raise
+        except BaseException as e:
+            await self.close(e)
+            raise
+
+    async def next_item(self) -> Any:
+        return await self.source.__anext__()
+
+    async def aclose(self):
+        await self.close(GeneratorExit())
+
+    async def close(self, error: Optional[BaseException]):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            if hasattr(self.source, 'aclose'):
+                await self.source.aclose()
+        finally:
+            if self.on_close is not None:
+                self.on_close(error)
+
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+DEFAULT_FLUSH_INTERVAL = 0.005
+
+
+def to_bytes(chunk: Any) -> Union[bytes, memoryview]:
+    if isinstance(chunk, (bytes, memoryview)):
+        return chunk
+    if isinstance(chunk, str):
+        return chunk.encode('utf-8')
+    return bytes(chunk)
+
+
+async def iterate_in_thread(iterator: Iterator, executor: Optional[Executor] = None,
+                            max_buffer: int = 1024) -> AsyncIterator[List[Any]]:
+    """
+    Run the synchronous iterator to completion in a single thread of the executor (by default the event loop's),
+    instead of hopping into the thread pool again for every single item. The items are handed over to the event
+    loop through a buffer of at most max_buffer items, and all items available at once are yielded together as one batch.
+    """
+    loop = asyncio.get_running_loop()
+    items = deque()
+    slots = threading.Semaphore(max_buffer)
+    ready = asyncio.Event()
+    stop = threading.Event()
+    waiting = False
+    error: Optional[BaseException] = None
+    end = object()
+
+    def produce():
+        nonlocal error
+        try:
+            for item in iterator:
+                while not slots.acquire(timeout=0.1):
+                    if stop.is_set():
+                        return
+                if stop.is_set():
+                    return
+                items.append(item)
+                if waiting:
+                    loop.call_soon_threadsafe(ready.set)
+        except BaseException as e:
+            error = e
+        finally:
+            items.append(end)
+            loop.call_soon_threadsafe(ready.set)
+            if hasattr(iterator, 'close'):
+                iterator.close()
+            finished.set_result(None)
+
+    # the producer is tracked as running work, so that concurrency slots are held until it has finished
+    finished = track_work(Future())
+    loop.run_in_executor(executor, produce)
+    try:
+        while True:
+            if not items:
+                ready.clear()
+                waiting = True
+                if not items:
+                    await ready.wait()
+                waiting = False
+            batch = [items.popleft() for _ in range(len(items))]
+            done = batch[-1] is end
+            if done:
+                batch.pop()
+                if error is not None:
+                    raise error
+            if batch:
+                slots.release(len(batch))
+                yield batch
+            if done:
+                break
+    finally:
+        # the producer thread finishes once the iterator returns its next item
+        stop.set()
+
+
+async def coalesce(source: AsyncIterator, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                   flush_interval: float = DEFAULT_FLUSH_INTERVAL) -> AsyncIterator[Union[bytes, memoryview]]:
+    """
+    Join small chunks from the source into chunks of up to chunk_size bytes, so that many tiny items do not
+    each become a write of their own. Buffered chunks are flushed at the latest after flush_interval seconds.
+    Chunks of at least chunk_size bytes are passed on as they are.
+    """
+    loop = asyncio.get_running_loop()
+    iterator = source.__aiter__()
+    buffer: List[Union[bytes, memoryview]] = []
+    size = 0
+    flush_at = 0.0
+    next_chunk = asyncio.ensure_future(iterator.__anext__())
+    try:
+        while True:
+            if buffer:
+                done, _ = await asyncio.wait({next_chunk}, timeout=max(flush_at - loop.time(), 0))
+                if not done:
+                    yield b''.join(buffer)
+                    buffer.clear()
+                    size = 0
+                    continue
+            try:
+                chunk = to_bytes(await next_chunk)
+            except StopAsyncIteration:
+                break
+            next_chunk = asyncio.ensure_future(iterator.__anext__())
+
+            if not buffer and len(chunk) >= chunk_size:
+                yield chunk
+                continue
+            if not buffer:
+                flush_at = loop.time() + flush_interval
+            buffer.append(chunk)
+            size += len(chunk)
+            if size >= chunk_size:
+                yield b''.join(buffer)
+                buffer.clear()
+                size = 0
+        if buffer:
+            yield b''.join(buffer)
+    finally:
+        next_chunk.cancel()
+
+
+def iterate_file(file: IO, chunk_size: int) -> Iterator[bytes]:
+    with file:
+        while chunk := file.read(chunk_size):
+            yield chunk
+
+
+async def make_stream_response(result: Any, media_type: str = 'application/octet-stream',
+                               chunk_size: int = DEFAULT_CHUNK_SIZE, flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+                               count: Optional[Callable[[int], None]] = None, executor: Optional[Executor] = None) -> 'Response':
+    """
+    Turn the result of a GET stream callback into a response:
+
+    - bytes, bytearray and memoryview are sent as they are, without copying them into a stream,
+    - files opened from a path are sent as file responses, which servers supporting it send via sendfile,
+    - other file-like objects and synchronous iterators are read in a single thread of the executor,
+    - items of (async) iterators are coalesced into chunks of up to chunk_size bytes.
+
+    The first chunk is awaited before the response is started, so errors raised by the callback before
+    producing any data, e.g. an HTTPException for missing permissions, still result in a proper error response.
+    """
+    from starlette.responses import Response, StreamingResponse, FileResponse
+
+    if isinstance(result, (bytes, bytearray, memoryview)):
+        if count is not None:
+            count(len(result))
+        return Response(bytes(result) if isinstance(result, bytearray) else result, media_type=media_type)
+
+    if hasattr(result, 'read'):
+        path = getattr(result, 'name', None)
+        if isinstance(path, str) and os.path.isfile(path) and 'b' in getattr(result, 'mode', ''):
+            result.close()
+            if count is not None:
+                count(os.path.getsize(path))
+            return FileResponse(path, media_type=media_type)
+        result = iterate_file(result, chunk_size)
+
+    if not hasattr(result, '__aiter__'):
+        result = (b''.join(map(to_bytes, batch)) async for batch in iterate_in_thread(iter(result), executor))
+
+    body = coalesce(result, chunk_size, flush_interval)
+    try:
+        first = await body.__anext__()
+    except StopAsyncIteration:
+        return Response(b'', media_type=media_type)
+
+    async def send():
+        if count is not None:
+            count(len(first))
+        yield first
+        async for chunk in body:
+            if count is not None:
+                count(len(chunk))
+            yield chunk
+
+    return StreamingResponse(send(), media_type=media_type)
+
+
+async def encode_partial_results(results: AsyncIterator[Any], media_type: str) -> AsyncIterator[bytes]:
+    """
+    Encode the partial results of a streaming action as server-sent events or as newline-delimited JSON.
+    An error while producing the results is sent as a final "error" event in case of server-sent events,
+    or as a final line `{"error": {"status": ..., "detail": ...}}` in case of newline-delimited JSON.
+    """
+    from fastapi import HTTPException
+
+    try:
+        async for result in results:
+            if media_type == 'text/event-stream':
+                yield b'data: ' + to_json(result, fallback=to_builtin) + b'\n\n'
+            else:
+                yield to_json(result, fallback=to_builtin) + b'\n'
+    except Exception as e:
+        if isinstance(e, HTTPException):
+            error = {'status': e.status_code, 'detail': e.detail}
+        else:
+            logger.exception('Streaming action failed')
+            error = {'status': 500, 'detail': {'cause': str(e)}}
+        if media_type == 'text/event-stream':
+            yield b'event: error\ndata: ' + to_json(error) + b'\n\n'
+        else:
+            yield to_json({'error': error}) + b'\n'
@@ -0,0 +1,167 @@
+import asyncio
+import logging
+import time
+import uuid
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Dict, Optional, Callable, Awaitable, Any
+
+from .models import TaskStatus
+from .executors import WorkTracker
+from .limits import request_deadline
+from .utils import http_error
+
+
+logger = logging.getLogger(__name__)
+
+
+class BackgroundTask:
+    """
+    An invocation running in the background, with its status and the login token it was started with.
+    """
+
+    __slots__ = ('status', 'login_token', 'task', 'tracker', 'finished_at')
+
+    def __init__(self, status: TaskStatus, login_token: Optional[str]):
+        self.status: TaskStatus = status
+        self.login_token: Optional[str] = login_token
+        self.task: Optional[asyncio.Task] = None
+        self.tracker: WorkTracker = WorkTracker()
+        self.finished_at: Optional[float] = None
+
+
+current_task: ContextVar[Optional[BackgroundTask]] = ContextVar('current_task', default=None)
+
+
+def report_progress(progress: Optional[float] = None, message: Optional[str] = None):
+    """
+    Report the progress of the current invocation as a fraction between 0 and 1, optionally with a message,
+    if it is running as a background task. Also works in actions running in a thread pool.
+    """
+    task = current_task.get()
+    if task is None:
+        return
+    if progress is not None:
+        task.status.progress = min(max(progress, 0.0), 1.0)
+    if message is not None:
+        task.status.message = message
+
+
+class TaskManager:
+    """
+    Runs invocations in the background, so that clients get a task ID right away and can poll its status,
+    progress and result instead of keeping the connection open. Finished tasks are kept for ttl seconds.
+    Tasks are kept in memory, so they are lost when the container restarts and only known to the worker
+    process that started them.
+
+    :param ttl: Seconds to keep the status and result of finished tasks.
+    :param max_running: Maximum number of running tasks, before rejecting new ones with 429.
+    :param cleanup_interval: Seconds between checks for expired tasks.
+    """
+
+    def __init__(self, ttl: float = 300.0, max_running: Optional[int] = None, cleanup_interval: float = 60.0):
+        self.ttl: float = ttl
+        self.max_running: Optional[int] = max_running
+        self.cleanup_interval: float = cleanup_interval
+        self.tasks: Dict[str, BackgroundTask] = {}
+        self.running: int = 0
+
+    def submit(self, action: str, invoke: Callable[[], Awaitable[Any]], login_token: Optional[str] = None,
+               agent_id: Optional[str] = None, timeout: Optional[float] = None) -> TaskStatus:
+        """
+        Start the invocation in the background and return its initial status.
+        The optional timeout sets the deadline for the invocation, as for requests.
+        """
+        if self.max_running is not None and self.running >= self.max_running:
+            raise http_error(429, 'Too many background tasks are running.', headers={'Retry-After': '1'})
+        status = TaskStatus(taskId=uuid.uuid4().hex, action=action, agentId=agent_id, createdAt=datetime.now(timezone.utc))
+        task = BackgroundTask(status, login_token)
+        self.tasks[status.taskId] = task
+        self.running += 1
+        task.task = asyncio.create_task(self.run(task, invoke, timeout))
+        task.task.add_done_callback(lambda _: self.stop(task))
+        return status
+
+    async def run(self, task: BackgroundTask, invoke: Callable[[], Awaitable[Any]], timeout: Optional[float]):
+        from fastapi import HTTPException
+        current_task.set(task)
+        if timeout is not None:
+            request_deadline.set(time.monotonic() + timeout)
+        status = task.status
+        try:
+            with task.tracker:
+                status.result = await invoke()
+            status.progress = 1.0
+            status.state = TaskStatus.State.SUCCEEDED
+        except HTTPException as e:
+            status.state = TaskStatus.State.FAILED
+            status.error = {'status': e.status_code, 'detail': e.detail}
+        except Exception as e:
+            logger.exception('Background task %s of action %s failed', status.taskId, status.action)
+            status.state = TaskStatus.State.FAILED
+            status.error = {'status': 500, 'detail': {'cause': str(e)}}
+
+    def stop(self, task: BackgroundTask):
+        # also called if the task was cancelled before it even started running
+        if task.status.state == TaskStatus.State.RUNNING:
+            task.status.state = TaskStatus.State.CANCELLED
+        # synchronous actions keep running in their thread when the task is cancelled,
+        # so the task only counts as finished once they have
+        task.tracker.when_done(lambda: self.finish(task))
+
+    def finish(self, task: BackgroundTask):
+        task.status.finishedAt = datetime.now(timezone.utc)
+        task.finished_at = time.monotonic()
+        task.task = None
+        self.running -= 1
+
+    def get(self, task_id: str, login_token: Optional[str] = None) -> Optional[BackgroundTask]:
+        """
+        Get the task, if it exists, has not expired and was started with the same login token.
+        """
+        task = self.tasks.get(task_id)
+        if task is None or task.login_token != login_token:
+            return None
+        if task.finished_at is not None and time.monotonic() - task.finished_at > self.ttl:
+            del self.tasks[task_id]
+            return None
+        return task
+
+    def cancel(self, task_id: str, login_token: Optional[str] = None) -> bool:
+        """
+        Cancel the task if it is still running, keeping its status until it expires,
+        or discard its status and result if it has finished. Returns whether the task existed.
+        """
+        task = self.get(task_id, login_token)
+        if task is None:
+            return False
+        if task.task is not None:
+            task.task.cancel()
+        else:
+            del self.tasks[task_id]
+        return True
+
+    def expire(self):
+        """
+        Discard all finished tasks that have expired.
+        """
+        now = time.monotonic()
+        for task_id, task in list(self.tasks.items()):
+            if task.finished_at is not None and now - task.finished_at > self.ttl:
+                del self.tasks[task_id]
+
+    async def run_cleanup(self):
+        """
+        Periodically discard expired tasks, until cancelled.
+        """
+        while True:
+            await asyncio.sleep(self.cleanup_interval)
+            self.expire()
+
+    def close(self):
+        """
+        Cancel all running tasks.
+        """
+        for task in self.tasks.values():
+            if task.task is not None:
+                task.task.cancel()
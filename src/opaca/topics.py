@@ -0,0 +1,125 @@
+import itertools
+from collections.abc import Mapping
+from typing import Dict, Set, Any, Hashable, List, Iterator, Optional
+
+
+class TopicNode:
+
+    def __init__(self):
+        self.children: Dict[str, 'TopicNode'] = {}
+        # subscribers with the sequence number of their subscription
+        self.subscribers: Dict[Hashable, int] = {}
+
+
+class TopicTree(Mapping):
+    """
+    Index of subscriptions to hierarchical channels, whose levels are separated by "/". Patterns may contain
+    wildcards: "*" matches exactly one level, e.g. "sensors/*/temperature", and "#" as the last level matches
+    any number of levels including none, e.g. "sensors/#" matches "sensors" and "sensors/kitchen/temperature".
+
+    Subscriptions are stored in a trie with the subscribers of each pattern, so looking up the subscribers
+    of a channel only depends on the number of levels and matching wildcards, not on the number of channels.
+    Subscribers are returned in the order they subscribed, so messages are delivered in a stable order.
+
+    For compatibility with the former dict of channels, the tree is also a read-only mapping from each
+    pattern to the list of its subscribers, e.g. `tree["sensors/#"]`, `"sensors/#" in tree` or `tree.items()`.
+    """
+
+    def __init__(self):
+        self.root: TopicNode = TopicNode()
+        self.subscriptions: Dict[Hashable, Set[str]] = {}
+        self.sequence: Iterator[int] = itertools.count()
+
+    @staticmethod
+    def split(pattern: str) -> List[str]:
+        levels = pattern.split('/')
+        if '#' in levels[:-1]:
+            raise ValueError(f'Invalid channel pattern "{pattern}", "#" is only allowed as the last level.')
+        return levels
+
+    def find(self, pattern: str) -> Optional[TopicNode]:
+        node = self.root
+        for level in pattern.split('/'):
+            node = node.children.get(level)
+            if node is None:
+                return None
+        return node
+
+    def subscribe(self, pattern: str, subscriber: Hashable):
+        node = self.root
+        for level in self.split(pattern):
+            node = node.children.setdefault(level, TopicNode())
+        if subscriber not in node.subscribers:
+            node.subscribers[subscriber] = next(self.sequence)
+        self.subscriptions.setdefault(subscriber, set()).add(pattern)
+
+    def unsubscribe(self, pattern: str, subscriber: Hashable):
+        path = [self.root]
+        for level in self.split(pattern):
+            node = path[-1].children.get(level)
+            if node is None:
+                return
+            path.append(node)
+        path[-1].subscribers.pop(subscriber, None)
+        patterns = self.subscriptions.get(subscriber)
+        if patterns is not None:
+            patterns.discard(pattern)
+            if not patterns:
+                del self.subscriptions[subscriber]
+        # remove nodes that neither have subscribers nor children anymore
+        for level, parent, node in zip(reversed(self.split(pattern)), reversed(path[:-1]), reversed(path[1:])):
+            if node.subscribers or node.children:
+                break
+            del parent.children[level]
+
+    def unsubscribe_all(self, subscriber: Hashable):
+        for pattern in list(self.subscriptions.get(subscriber, ())):
+            self.unsubscribe(pattern, subscriber)
+
+    def match(self, channel: str) -> List[Any]:
+        """
+        Get the subscribers of all patterns matching the channel, each once, in the order they subscribed.
+        """
+        matched = []
+        nodes = [self.root]
+        for level in channel.split('/'):
+            next_nodes = []
+            for node in nodes:
+                if '#' in node.children:
+                    matched.append(node.children['#'])
+                if level in node.children:
+                    next_nodes.append(node.children[level])
+                if '*' in node.children:
+                    next_nodes.append(node.children['*'])
+            nodes = next_nodes
+            if not nodes:
+                break
+        for node in nodes:
+            matched.append(node)
+            if '#' in node.children:
+                matched.append(node.children['#'])
+        if len(matched) == 1:
+            return list(matched[0].subscribers)
+        matches = {}
+        for node in matched:
+            for subscriber, sequence in node.subscribers.items():
+                if sequence < matches.get(subscriber, sequence + 1):
+                    matches[subscriber] = sequence
+        return sorted(matches, key=matches.__getitem__)
+
+    def __getitem__(self, pattern: str) -> List[Any]:
+        node = self.find(pattern)
+        if node is None or not node.subscribers:
+            raise KeyError(pattern)
+        return list(node.subscribers)
+
+    def __iter__(self) -> Iterator[str]:
+        nodes = [(None, self.root)]
+        while nodes:
+            pattern, node = nodes.pop()
+            if node.subscribers:
+                yield pattern
+            nodes.extend((level if pattern is None else f'{pattern}/{level}', child) for level, child in reversed(node.children.items()))
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
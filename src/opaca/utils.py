@@ -1,8 +1,13 @@
-from fastapi import HTTPException
+from typing import Dict, Optional, TYPE_CHECKING
 
+if TYPE_CHECKING:
+    from fastapi import HTTPException
 
-def http_error(code: int, cause: str) -> HTTPException:
+
+def http_error(code: int, cause: str, headers: Optional[Dict[str, str]] = None) -> 'HTTPException':
     """
     custom http exception like in assessment example solution
     """
-    return HTTPException(status_code=code, detail={"cause": cause})
+    # imported here, so that FastAPI is only loaded once it is actually needed
+    from fastapi import HTTPException
+    return HTTPException(status_code=code, detail={"cause": cause}, headers=headers)
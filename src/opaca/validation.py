@@ -0,0 +1,77 @@
+import inspect
+from typing import Dict, Any, Callable, List, get_type_hints
+
+from pydantic import TypeAdapter, ValidationError, ConfigDict, PydanticSchemaGenerationError, PydanticUndefinedAnnotation
+from typing_extensions import TypedDict, Required, NotRequired
+
+from .models import Parameter
+from .arrays import make_array_hint, resolve_hint
+from .utils import http_error
+
+
+json_type_mapping = {
+    "string": str,
+    "integer": int,
+    "number": float,
+    "boolean": bool,
+    "object": dict,
+    "null": type(None),
+}
+
+
+def parameter_to_python_type(param: Parameter | Parameter.ArrayItems) -> Any:
+    """
+    Transform a parameter type back into a python type hint. Unknown (custom) types are not validated.
+    """
+    if param.type == "array" and getattr(param, "dtype", None) is not None:
+        return make_array_hint(param.dtype, param.shape)
+    if param.type == "array":
+        return List[parameter_to_python_type(param.items)] if param.items else list
+    return json_type_mapping.get(param.type, Any)
+
+
+def get_validated_hint(hint: Any) -> Any:
+    """
+    Get the type hint to validate a parameter with. Parameters typed with classes Pydantic can not validate,
+    i.e. neither Pydantic models, dataclasses nor TypedDicts, are passed on as they are, as before validation.
+    """
+    resolved = resolve_hint(hint)
+    if resolved is not hint:
+        return resolved
+    try:
+        TypeAdapter(hint)
+    except (PydanticSchemaGenerationError, PydanticUndefinedAnnotation):
+        return Any
+    return hint
+
+
+def make_validator(name: str, parameters: Dict[str, Parameter], callback: Callable) -> Callable[[Dict[str, Any]], Dict[str, Any]]:
+    """
+    Compile a validator for the parameters of an action. The callback's type hints are used where available,
+    otherwise the types are derived from the action's parameter descriptions. The validator returns the coerced
+    parameters, containing only the keys that were actually provided, or raises a 422 error for invalid input.
+    """
+    try:
+        type_hints = get_type_hints(callback)
+        signature = inspect.signature(callback).parameters
+    except (TypeError, ValueError, NameError):
+        type_hints, signature = {}, {}
+
+    fields = {}
+    for p_name, param in parameters.items():
+        hint = get_validated_hint(type_hints[p_name]) if p_name in type_hints else parameter_to_python_type(param)
+        has_default = p_name in signature and signature[p_name].default is not inspect.Parameter.empty
+        fields[p_name] = Required[hint] if param.required and not has_default else NotRequired[hint]
+
+    typed_dict = TypedDict(f'{name}Parameters', fields)
+    typed_dict.__pydantic_config__ = ConfigDict(extra='forbid', arbitrary_types_allowed=True)
+    adapter = TypeAdapter(typed_dict)
+
+    def validate(values: Dict[str, Any]) -> Dict[str, Any]:
+        try:
+            return adapter.validate_python(values)
+        except ValidationError as e:
+            errors = '; '.join(f'{".".join(str(loc) for loc in error["loc"])}: {error["msg"]}' for error in e.errors())
+            raise http_error(422, f'Invalid parameters for action {name}: {errors}')
+
+    return validate
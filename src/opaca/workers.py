@@ -0,0 +1,106 @@
+import json
+import os
+import warnings
+from typing import Callable, Union, Optional, Dict, Any, List, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from fastapi import FastAPI
+    from .abstract_agent import AbstractAgent
+    from .container import Container
+
+
+WORKERS_ENV = 'OPACA_WORKERS'
+FACTORY_ENV = 'OPACA_CONTAINER_FACTORY'
+OPTIONS_ENV = 'OPACA_APP_OPTIONS'
+
+
+def get_import_string(factory: Union[str, Callable[[], 'Container']]) -> str:
+    """
+    Get the "module:function" string under which the worker processes can import the container factory.
+    """
+    if isinstance(factory, str):
+        return factory
+    module, name = getattr(factory, '__module__', None), getattr(factory, '__qualname__', '')
+    if module is None or '.' in name or '<' in name:
+        raise ValueError('The container factory must be a function defined at the top level of a module.')
+    return f'{module}:{name}'
+
+
+def create_container(factory: Union[str, Callable[[], 'Container']]) -> 'Container':
+    """
+    Create the container with the factory function or its import string.
+    """
+    if isinstance(factory, str):
+        from uvicorn.importer import import_from_string
+        factory = import_from_string(factory)
+    return factory()
+
+
+def requires_auth(container: 'Container') -> List['AbstractAgent']:
+    """
+    Get the agents having actions or streams that require authentication.
+    """
+    return [agent for agent in container.agents.values()
+            if any(getattr(action.callback, '_auth', False) for action in agent.actions.values())
+            or any(getattr(stream.callback, '_auth', False) for stream in agent.streams.values())]
+
+
+def check_sessions(container: 'Container') -> None:
+    """
+    Check that logins work with several worker processes, each with its own container. A login is handled by one
+    of the workers, so containers with actions or streams requiring authentication need a session store shared by
+    all workers, or the token would only be valid in that worker. Agents implementing handle_login() also only
+    receive the login in that worker, which is warned about.
+    """
+    from .abstract_agent import AbstractAgent
+    from .sessions import MemorySessionStore
+
+    agents = requires_auth(container)
+    if not agents:
+        return
+    if isinstance(container.sessions.store, MemorySessionStore):
+        raise ValueError('Running several workers with actions or streams requiring authentication needs a session '
+                         'store shared by all workers, e.g. SessionManager(SqliteSessionStore(...)) or '
+                         'SessionManager(RedisSessionStore(...)), since login sessions kept in memory are only '
+                         'known to the worker that handled the login.')
+    if any(type(agent).handle_login is not AbstractAgent.handle_login for agent in agents):
+        warnings.warn('handle_login() is only called on the agents of the worker process that handled the login, '
+                      'so agents should keep credentials they need for later requests in a shared store.')
+
+
+def create_app() -> 'FastAPI':
+    """
+    App factory run by uvicorn in each worker process: imports the container factory given by the parent
+    process, lets it build the container with all its agents and creates the routes for it.
+    """
+    from .routes import create_routes
+
+    container = create_container(os.environ[FACTORY_ENV])
+    check_sessions(container)
+    options = json.loads(os.environ.get(OPTIONS_ENV, '{}'))
+    if options.get('executor') is not None or options.get('max_workers') is not None:
+        container.set_executor(options.get('executor') or container.executors.default, options.get('max_workers'))
+    return create_routes(options.get('title') or container.image.imageName, container,
+                         metrics=options.get('metrics', False), profile=options.get('profile', 'development'))
+
+
+def run_workers(factory: Union[str, Callable[[], 'Container']], workers: int, host: str, port: Optional[int],
+                server_options: Dict[str, Any], options: Dict[str, Any]) -> None:
+    """
+    Run uvicorn with several worker processes, each creating its own container with the factory.
+    The factory and options are passed to the workers via environment variables.
+    """
+    import uvicorn
+
+    if not isinstance(options.get('executor'), (str, type(None))):
+        raise ValueError('Running several workers requires the executor to be given by its type.')
+    os.environ[WORKERS_ENV] = str(workers)
+    os.environ[FACTORY_ENV] = get_import_string(factory)
+    os.environ[OPTIONS_ENV] = json.dumps(options)
+    # one container is created in the main process as well, to check it before starting the workers
+    # and to read the port from the image description
+    container = create_container(factory)
+    check_sessions(container)
+    if port is None:
+        port = container.image.apiPort
+    uvicorn.run('opaca.workers:create_app', factory=True, host=host, port=port, workers=workers, **server_options)